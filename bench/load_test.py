@@ -0,0 +1,253 @@
+"""Drive the FastAPI app in-process with a simulated device fleet.
+
+Devices poll /api/iot/table-status, dashboards list /api/tables and chefs
+update table statuses, all through httpx's ASGI transport against an
+in-memory stand-in for MongoDB. Results are written as JSON so runs can be
+compared with --baseline.
+
+    python bench/load_test.py --devices 500 --duration 10 --output bench_results.json
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import platform
+import random
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+os.environ.setdefault("JWT_SECRET", "benchmark-secret")
+os.environ.setdefault("ADMIN_USERNAME", "chef")
+os.environ.setdefault("ADMIN_PASSWORD", "chef123")
+# Keep the host-wide status table away from a real server's
+os.environ.setdefault("SHARED_STATUS_PATH", os.path.join(tempfile.mkdtemp(prefix="bench-"), "status.bin"))
+
+import httpx  # noqa: E402
+import memory_mongo  # noqa: E402
+
+memory_mongo.install()
+
+from main import app  # noqa: E402
+
+STATUSES = ["idle", "placed", "processing", "delivered"]
+
+
+class Recorder:
+    def __init__(self):
+        self.latencies = {}
+        self.status_codes = {}
+
+    def record(self, scenario, started, response):
+        self.latencies.setdefault(scenario, []).append(time.perf_counter() - started)
+        codes = self.status_codes.setdefault(scenario, {})
+        codes[response.status_code] = codes.get(response.status_code, 0) + 1
+
+
+def percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(latencies, elapsed):
+    return {
+        "requests": len(latencies),
+        "throughput_rps": round(len(latencies) / elapsed, 1),
+        "mean_ms": round(statistics.fmean(latencies) * 1000, 3),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 3),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 3),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 3),
+    }
+
+
+async def login(client):
+    response = await client.post("/api/auth/login", json={
+        "username": os.environ["ADMIN_USERNAME"],
+        "password": os.environ["ADMIN_PASSWORD"],
+    })
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+
+async def seed_tables(client, headers, count):
+    tables = []
+    for i in range(count):
+        response = await client.post("/api/tables/", json={"tableName": f"Bench Table {i}"}, headers=headers)
+        response.raise_for_status()
+        tables.append(response.json())
+    return tables
+
+
+async def device(client, recorder, table, interval, deadline):
+    version = None
+    # Spread the first polls so devices don't start in lockstep
+    await asyncio.sleep(random.uniform(0, interval))
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        body = {"tableId": table["tableId"]}
+        if version is not None:
+            body["version"] = version
+        response = await client.post("/api/iot/table-status", json=body)
+        recorder.record("device_poll", started, response)
+        if response.status_code == 200:
+            version = response.json().get("version")
+        await asyncio.sleep(interval)
+
+
+async def dashboard(client, recorder, headers, interval, deadline):
+    while time.perf_counter() < deadline:
+        started = time.perf_counter()
+        response = await client.get("/api/tables/", headers=headers)
+        recorder.record("dashboard_list", started, response)
+        await asyncio.sleep(interval)
+
+
+async def chef(client, recorder, headers, tables, interval, deadline):
+    while time.perf_counter() < deadline:
+        table = random.choice(tables)
+        started = time.perf_counter()
+        response = await client.put(
+            f"/api/tables/{table['_id']}", json={"status": random.choice(STATUSES)}, headers=headers
+        )
+        recorder.record("status_update", started, response)
+        await asyncio.sleep(interval)
+
+
+async def measure_allocations(client, headers, tables, samples):
+    """Peak traced memory and net retained blocks per request, per scenario."""
+    requests = {
+        "device_poll": lambda t: client.post("/api/iot/table-status", json={"tableId": t["tableId"]}),
+        "dashboard_list": lambda t: client.get("/api/tables/", headers=headers),
+        "status_update": lambda t: client.put(
+            f"/api/tables/{t['_id']}", json={"status": random.choice(STATUSES)}, headers=headers
+        ),
+    }
+    results = {}
+    tracemalloc.start()
+    try:
+        for scenario, send in requests.items():
+            await send(tables[0])  # warm up
+            peaks = []
+            gc.collect()
+            blocks_before = sys.getallocatedblocks()
+            for i in range(samples):
+                tracemalloc.reset_peak()
+                baseline, _ = tracemalloc.get_traced_memory()
+                await send(tables[i % len(tables)])
+                _, peak = tracemalloc.get_traced_memory()
+                peaks.append(peak - baseline)
+            gc.collect()
+            results[scenario] = {
+                "peak_alloc_bytes": round(statistics.fmean(peaks)),
+                "retained_blocks_per_request": round((sys.getallocatedblocks() - blocks_before) / samples, 2),
+            }
+    finally:
+        tracemalloc.stop()
+    return results
+
+
+async def run(args):
+    random.seed(args.seed)
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+            headers = await login(client)
+            tables = await seed_tables(client, headers, args.tables)
+
+            memory_mongo.reset_op_counts()
+            recorder = Recorder()
+            started = time.perf_counter()
+            deadline = started + args.duration
+            tasks = [
+                device(client, recorder, tables[i % len(tables)], args.poll_interval, deadline)
+                for i in range(args.devices)
+            ]
+            tasks += [dashboard(client, recorder, headers, args.dashboard_interval, deadline)
+                      for _ in range(args.dashboards)]
+            tasks += [chef(client, recorder, headers, tables, args.update_interval, deadline)
+                      for _ in range(args.chefs)]
+            await asyncio.gather(*tasks)
+            elapsed = time.perf_counter() - started
+
+            total = sum(len(v) for v in recorder.latencies.values())
+            db_ops = dict(sorted(memory_mongo.MemoryCollection.op_counts.items()))
+            allocations = await measure_allocations(client, headers, tables, args.alloc_samples)
+
+    return {
+        "timestamp": datetime.now().isoformat(),
+        "python": platform.python_version(),
+        "config": vars(args),
+        "elapsed_s": round(elapsed, 3),
+        "overall": summarize([x for v in recorder.latencies.values() for x in v], elapsed),
+        "scenarios": {
+            name: {
+                **summarize(latencies, elapsed),
+                "status_codes": {str(k): v for k, v in recorder.status_codes[name].items()},
+                **allocations.get(name, {}),
+            }
+            for name, latencies in recorder.latencies.items()
+        },
+        "db_ops": db_ops,
+        "db_ops_per_request": round(sum(db_ops.values()) / total, 3) if total else 0,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """Return regressions where p95 latency or throughput moved past tolerance."""
+    regressions = []
+    for name, current in result["scenarios"].items():
+        previous = baseline.get("scenarios", {}).get(name)
+        if not previous:
+            continue
+        if current["p95_ms"] > previous["p95_ms"] * (1 + tolerance):
+            regressions.append(f"{name}: p95 {previous['p95_ms']}ms -> {current['p95_ms']}ms")
+        if current["throughput_rps"] < previous["throughput_rps"] * (1 - tolerance):
+            regressions.append(
+                f"{name}: throughput {previous['throughput_rps']} -> {current['throughput_rps']} req/s"
+            )
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--devices", type=int, default=200, help="simulated polling devices")
+    parser.add_argument("--tables", type=int, default=100, help="tables to seed")
+    parser.add_argument("--dashboards", type=int, default=2, help="dashboards listing tables")
+    parser.add_argument("--chefs", type=int, default=2, help="clients updating statuses")
+    parser.add_argument("--duration", type=float, default=10, help="seconds to run")
+    parser.add_argument("--poll-interval", type=float, default=0.5, help="device poll interval (s)")
+    parser.add_argument("--dashboard-interval", type=float, default=1.0, help="dashboard refresh interval (s)")
+    parser.add_argument("--update-interval", type=float, default=0.2, help="per-chef update interval (s)")
+    parser.add_argument("--alloc-samples", type=int, default=200, help="requests per scenario under tracemalloc")
+    parser.add_argument("--seed", type=int, default=1312)
+    parser.add_argument("--output", help="write results JSON here")
+    parser.add_argument("--baseline", help="previous results JSON to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed relative regression")
+    args = parser.parse_args()
+
+    result = asyncio.run(run(args))
+    print(json.dumps(result, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(result, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(result, json.load(f), args.tolerance)
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
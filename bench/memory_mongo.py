@@ -0,0 +1,337 @@
+"""In-memory stand-in for the Motor collections used by the server.
+
+Implements just the subset of the Motor API the routes call, so the app can
+be driven in-process without a MongoDB instance. It is meant for
+benchmarking and local experiments, not as a general Mongo emulator.
+"""
+import copy
+from bson import ObjectId
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+
+
+class Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+
+
+def _matches(doc, query):
+    for key, condition in query.items():
+        value = doc.get(key)
+        if isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition):
+            for op, arg in condition.items():
+                if op == "$in" and value not in arg:
+                    return False
+                if op == "$nin" and value in arg:
+                    return False
+                if op == "$ne" and value == arg:
+                    return False
+                if op == "$gt" and (value is None or not value > arg):
+                    return False
+                if op == "$gte" and (value is None or not value >= arg):
+                    return False
+                if op == "$lt" and (value is None or not value < arg):
+                    return False
+                if op == "$lte" and (value is None or not value <= arg):
+                    return False
+                if op == "$exists" and (key in doc) != arg:
+                    return False
+        elif value != condition:
+            return False
+    return True
+
+
+def _project(doc, projection):
+    if not projection:
+        return copy.deepcopy(doc)
+    include_id = projection.get("_id", 1)
+    included = {k for k, v in projection.items() if v and k != "_id"}
+    if included:
+        out = {k: copy.deepcopy(v) for k, v in doc.items() if k in included}
+        if include_id and "_id" in doc:
+            out = {"_id": doc["_id"], **out}
+        return out
+    excluded = {k for k, v in projection.items() if not v}
+    return {k: copy.deepcopy(v) for k, v in doc.items() if k not in excluded}
+
+
+def _apply_update(doc, update):
+    for key, value in update.get("$set", {}).items():
+        doc[key] = value
+    for key, value in update.get("$setOnInsert", {}).items():
+        doc.setdefault(key, value)
+    for key, value in update.get("$inc", {}).items():
+        parent, _, child = key.partition(".")
+        if child:
+            nested = doc.setdefault(parent, {})
+            nested[child] = nested.get(child, 0) + value
+        else:
+            doc[key] = doc.get(key, 0) + value
+    for key, value in update.get("$push", {}).items():
+        items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+        doc.setdefault(key, []).extend(copy.deepcopy(items))
+    for key, value in update.get("$max", {}).items():
+        if key not in doc or value > doc[key]:
+            doc[key] = value
+    for key in update.get("$unset", {}):
+        doc.pop(key, None)
+
+
+class MemoryCursor:
+    def __init__(self, docs):
+        self._docs = docs
+        self._skip = 0
+        self._limit = 0
+
+    def sort(self, key, direction=1):
+        keys = key if isinstance(key, list) else [(key, direction)]
+        for field, order in reversed(keys):
+            self._docs.sort(key=lambda d: (d.get(field) is not None, d.get(field)), reverse=order < 0)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def batch_size(self, size):
+        return self
+
+    def _selected(self):
+        docs = self._docs[self._skip:]
+        return docs[:self._limit] if self._limit else docs
+
+    def __aiter__(self):
+        self._iter = iter(self._selected())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iter)
+        except StopIteration:
+            raise StopAsyncIteration
+
+    async def to_list(self, length=None):
+        docs = self._selected()
+        return docs[:length] if length else docs
+
+
+class MemoryCollection:
+    def __init__(self, name):
+        self.name = name
+        self._docs = {}
+        self._unique = []
+        self._indexes = ["_id_"]
+
+    # Counters so the benchmark can report database operations per request
+    op_counts = {}
+
+    def _count(self, op):
+        key = f"{self.name}.{op}"
+        MemoryCollection.op_counts[key] = MemoryCollection.op_counts.get(key, 0) + 1
+
+    def _check_unique(self, doc, skip_id=None):
+        for field in self._unique:
+            if field not in doc:
+                continue
+            for other in self._docs.values():
+                if other["_id"] != skip_id and other.get(field) == doc[field]:
+                    raise DuplicateKeyError(
+                        f"E11000 duplicate key error collection: {self.name} index: {field}_1",
+                        11000,
+                        {"keyPattern": {field: 1}, "errmsg": f"index: {field}_1"},
+                    )
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        field = keys if isinstance(keys, str) else keys[0][0]
+        name = f"{field}_1"
+        if unique:
+            # Like Mongo, a unique index can't be built over existing duplicates
+            values = [doc[field] for doc in self._docs.values() if field in doc]
+            if len(values) != len(set(values)):
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.name} index: {name}", 11000
+                )
+        if unique and field not in self._unique:
+            self._unique.append(field)
+        if name not in self._indexes:
+            self._indexes.append(name)
+        return name
+
+    async def find_one(self, query=None, projection=None, **kwargs):
+        self._count("find_one")
+        for doc in self._docs.values():
+            if _matches(doc, query or {}):
+                return _project(doc, projection)
+        return None
+
+    def find(self, query=None, projection=None, **kwargs):
+        self._count("find")
+        return MemoryCursor([_project(d, projection) for d in self._docs.values() if _matches(d, query or {})])
+
+    async def count_documents(self, query, **kwargs):
+        self._count("count_documents")
+        return sum(1 for d in self._docs.values() if _matches(d, query))
+
+    async def insert_one(self, document, **kwargs):
+        self._count("insert_one")
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        self._docs[document["_id"]] = copy.deepcopy(document)
+        return Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        self._count("insert_many")
+        ids = []
+        for document in documents:
+            document.setdefault("_id", ObjectId())
+            self._check_unique(document)
+            self._docs[document["_id"]] = copy.deepcopy(document)
+            ids.append(document["_id"])
+        return Result(inserted_ids=ids)
+
+    def _update(self, query, update, upsert=False, many=False):
+        matched = 0
+        for doc in list(self._docs.values()):
+            if not _matches(doc, query):
+                continue
+            updated = copy.deepcopy(doc)
+            _apply_update(updated, {k: v for k, v in update.items() if k != "$setOnInsert"})
+            self._check_unique(updated, skip_id=doc["_id"])
+            self._docs[doc["_id"]] = updated
+            matched += 1
+            if not many:
+                break
+        upserted_id = None
+        if not matched and upsert:
+            doc = {k: v for k, v in query.items() if not isinstance(v, dict)}
+            doc.setdefault("_id", ObjectId())
+            _apply_update(doc, update)
+            self._check_unique(doc)
+            self._docs[doc["_id"]] = doc
+            upserted_id = doc["_id"]
+        return Result(matched_count=matched, modified_count=matched, upserted_id=upserted_id)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        self._count("update_one")
+        return self._update(query, update, upsert=upsert)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        self._count("update_many")
+        return self._update(query, update, upsert=upsert, many=True)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        self._count("bulk_write")
+        errors = []
+        counts = {"nMatched": 0, "nModified": 0, "nUpserted": 0, "nInserted": 0}
+        for index, request in enumerate(requests):
+            kind = type(request).__name__
+            try:
+                if kind == "InsertOne":
+                    self._docs_insert(request._doc)
+                    counts["nInserted"] += 1
+                else:
+                    result = self._update(
+                        request._filter, request._doc,
+                        upsert=bool(request._upsert), many=kind == "UpdateMany",
+                    )
+                    counts["nMatched"] += result.matched_count
+                    counts["nModified"] += result.modified_count
+                    counts["nUpserted"] += int(result.upserted_id is not None)
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e)})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({"writeErrors": errors, **counts})
+        return Result(
+            matched_count=counts["nMatched"],
+            modified_count=counts["nModified"],
+            upserted_count=counts["nUpserted"],
+            inserted_count=counts["nInserted"],
+        )
+
+    def _docs_insert(self, document):
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        self._docs[document["_id"]] = copy.deepcopy(document)
+
+    async def find_one_and_update(self, query, update, return_document=False, upsert=False, projection=None, **kwargs):
+        self._count("find_one_and_update")
+        before = next((d for d in self._docs.values() if _matches(d, query)), None)
+        before = copy.deepcopy(before)
+        result = self._update(query, update, upsert=upsert)
+        if return_document:  # ReturnDocument.AFTER is True
+            _id = before["_id"] if before else result.upserted_id
+            after = self._docs.get(_id)
+            return _project(after, projection) if after else None
+        return _project(before, projection) if before else None
+
+    async def find_one_and_delete(self, query, **kwargs):
+        self._count("find_one_and_delete")
+        for doc in list(self._docs.values()):
+            if _matches(doc, query):
+                return self._docs.pop(doc["_id"])
+        return None
+
+    async def delete_one(self, query, **kwargs):
+        self._count("delete_one")
+        for doc in list(self._docs.values()):
+            if _matches(doc, query):
+                del self._docs[doc["_id"]]
+                return Result(deleted_count=1)
+        return Result(deleted_count=0)
+
+    async def delete_many(self, query, **kwargs):
+        self._count("delete_many")
+        doomed = [d["_id"] for d in self._docs.values() if _matches(d, query)]
+        for _id in doomed:
+            del self._docs[_id]
+        return Result(deleted_count=len(doomed))
+
+
+class MemoryDatabase:
+    def __init__(self):
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def command(self, name, *args, **kwargs):
+        # Only what the server sends during startup and readiness checks
+        if name != "ping":
+            raise NotImplementedError(name)
+        return {"ok": 1.0}
+
+
+def install():
+    """Swap every Motor collection in the server's database module for an
+    in-memory one. Must run before the routes are imported."""
+    import database
+    from metrics import TimedCollection
+    from motor.motor_asyncio import AsyncIOMotorCollection
+
+    memory_db = MemoryDatabase()
+    for name, value in list(vars(database).items()):
+        if isinstance(value, TimedCollection):
+            # Keep the timing wrapper so the benchmark measures it too, but drop
+            # the methods it cached for the collection being replaced
+            value.__dict__ = {"collection": memory_db[value.name], "name": value.name}
+        elif isinstance(value, AsyncIOMotorCollection):
+            setattr(database, name, memory_db[value.name])
+    database.db = memory_db
+    return memory_db
+
+
+def reset_op_counts():
+    MemoryCollection.op_counts = {}
+
@@ -38,6 +38,10 @@ export const AuthProvider = ({ children }) => {
     };
 
     const logout = () => {
+        if (localStorage.getItem('token')) {
+            // Revoke server-side too; the local logout must not wait on it
+            api.post('/auth/logout').catch(() => {});
+        }
         localStorage.removeItem('token');
         setUser(null);
     };
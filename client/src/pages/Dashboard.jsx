@@ -35,10 +35,57 @@ const Dashboard = () => {
         }
     };
 
+    const applyTableEvent = (message) => {
+        const { type, table } = JSON.parse(message.data)
+        setTables(current => {
+            if (type === 'deleted') return current.filter(t => t._id !== table._id)
+            const index = current.findIndex(t => t._id === table._id)
+            if (index === -1) return [...current, table]
+            return current.map(t => t._id === table._id ? table : t)
+        })
+    };
+
     useEffect(() => {
         fetchTables()
-        const interval = setInterval(fetchTables, 5000)
-        return () => clearInterval(interval)
+        // The server pushes every table change; refetch on (re)connect to cover any gap.
+        // Each connection needs a fresh single-use ticket, so reconnects are done here
+        // instead of by EventSource.
+        let events = null
+        let retry = null
+        let closed = false
+
+        const reconnectLater = () => {
+            if (!closed) retry = setTimeout(connect, 3000)
+        }
+
+        const connect = async () => {
+            try {
+                const { data } = await api.post('/tables/events/ticket')
+                if (closed) return
+                events = new EventSource(`${api.defaults.baseURL}/tables/events?ticket=${encodeURIComponent(data.ticket)}`)
+                events.onopen = fetchTables
+                events.onmessage = applyTableEvent
+                events.onerror = () => {
+                    events.close()
+                    reconnectLater()
+                }
+            } catch (error) {
+                if (error.response?.status === 401) {
+                    // Session expired or was revoked; the stream can't be reopened
+                    logout()
+                    return
+                }
+                console.error('Error opening table events:', error)
+                reconnectLater()
+            }
+        }
+
+        connect()
+        return () => {
+            closed = true
+            clearTimeout(retry)
+            if (events) events.close()
+        }
     }, [])
 
     const handleAddTable = async (e) => {
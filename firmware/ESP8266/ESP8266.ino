@@ -2,6 +2,7 @@
 #include <ESP8266HTTPClient.h>
 #include <WiFiClient.h>
 #include <ArduinoJson.h>
+#include <WiFiUdp.h>
 
 const char* ssid = "Airtel_7904030785";
 const char* password = "air46278";
@@ -13,6 +14,28 @@ const int ledPlaced = D1;
 const int ledProcessing = D2;
 const int ledDelivered = D3;
 
+const char* firmwareVersion = "1.1.0";
+
+// Used until the server sends a nextPollMs hint, and clamp for the hint
+const unsigned long defaultPollMs = 5000;
+const unsigned long minPollMs = 1000;
+const unsigned long maxPollMs = 120000;
+
+long lastVersion = -1;
+unsigned long nextPollMs = defaultPollMs;
+int failures = 0;
+
+// Poll over the server's binary UDP status protocol (STATUS_PROTOCOL_ENABLED=true)
+// instead of HTTP + JSON
+const bool useStatusProtocol = false;
+const char* statusHost = "192.168.1.100";
+const uint16_t statusPort = 1313;
+const unsigned long statusTimeoutMs = 1000;
+const char* statusNames[] = {"idle", "placed", "processing", "delivered"};
+
+WiFiUDP udp;
+uint32_t requestId = 0;
+
 void setup() {
   Serial.begin(115200);
   
@@ -31,21 +54,42 @@ void setup() {
     Serial.print(".");
   }
   Serial.println("\nConnected to WiFi");
+  if (useStatusProtocol) {
+    udp.begin(statusPort);  // Local port the replies come back to
+  }
+
+  // Boards that lost power together should not all poll at the same moment
+  randomSeed(RANDOM_REG32);
+  delay(random(0, defaultPollMs));
 }
 
 void loop() {
-  if (WiFi.status() == WL_CONNECTED) {
+  if (WiFi.status() == WL_CONNECTED && useStatusProtocol) {
+    if (!pollStatusProtocol()) {
+      backOff();
+    }
+  } else if (WiFi.status() == WL_CONNECTED) {
     WiFiClient client;
     HTTPClient http;
     http.begin(client, serverUrl);
     http.addHeader("Content-Type", "application/json");
+    const char* headerKeys[] = {"X-Next-Poll-Ms"};
+    http.collectHeaders(headerKeys, 1);
 
-    // Create JSON request
-    String requestBody = "{\"tableId\":\"" + String(tableId) + "\"}";
+    // Create JSON request; the version lets the server answer 304 when nothing changed
+    String requestBody = "{\"tableId\":\"" + String(tableId) + "\",\"firmware\":\"" + String(firmwareVersion) + "\"";
+    if (lastVersion >= 0) {
+      requestBody += ",\"version\":" + String(lastVersion);
+    }
+    requestBody += "}";
     
     int httpResponseCode = http.POST(requestBody);
     
-    if (httpResponseCode > 0) {
+    if (httpResponseCode == 304) {
+      // Status unchanged, keep the LEDs as they are
+      failures = 0;
+      setNextPoll(http.header("X-Next-Poll-Ms").toInt());
+    } else if (httpResponseCode > 0) {
       String response = http.getString();
       Serial.println(httpResponseCode);
       Serial.println(response);
@@ -57,6 +101,10 @@ void loop() {
       if (!error) {
         const char* status = doc["status"];
         updateLEDs(status);
+        lastVersion = doc["version"] | -1;
+        failures = 0;
+        // Older servers don't send a hint; setNextPoll falls back to the default
+        setNextPoll(doc["nextPollMs"] | 0);
       } else {
         Serial.print("deserializeJson() failed: ");
         Serial.println(error.c_str());
@@ -64,13 +112,88 @@ void loop() {
     } else {
       Serial.print("Error on sending POST: ");
       Serial.println(httpResponseCode);
+      backOff();
     }
     http.end();
   } else {
     Serial.println("WiFi Disconnected");
+    backOff();
   }
   
-  delay(5000); // Poll every 5 seconds
+  delay(nextPollMs);
+}
+
+void putUint32(uint8_t* buffer, uint32_t value) {
+  buffer[0] = value >> 24;
+  buffer[1] = value >> 16;
+  buffer[2] = value >> 8;
+  buffer[3] = value;
+}
+
+uint32_t getUint32(const uint8_t* buffer) {
+  return ((uint32_t)buffer[0] << 24) | ((uint32_t)buffer[1] << 16) | ((uint32_t)buffer[2] << 8) | buffer[3];
+}
+
+bool pollStatusProtocol() {
+  // Query: version, flags, request id, last version, tableId length, tableId
+  uint8_t query[48];
+  size_t idLength = strlen(tableId);
+  requestId++;
+  query[0] = 1;
+  query[1] = 0;  // unsigned
+  putUint32(query + 2, requestId);
+  putUint32(query + 6, lastVersion >= 0 ? (uint32_t)lastVersion : 0xFFFFFFFF);
+  query[10] = idLength;
+  memcpy(query + 11, tableId, idLength);
+
+  udp.beginPacket(statusHost, statusPort);
+  udp.write(query, 11 + idLength);
+  udp.endPacket();
+
+  unsigned long started = millis();
+  while (millis() - started < statusTimeoutMs) {
+    if (udp.parsePacket() < 14) {
+      delay(10);
+      continue;
+    }
+    // Reply: version, result, request id, status code, flags, version, next poll (100 ms)
+    uint8_t reply[32];
+    udp.read(reply, sizeof(reply));
+    if (reply[0] != 1 || getUint32(reply + 2) != requestId) {
+      continue;  // Late answer to an earlier query
+    }
+    uint8_t result = reply[1];
+    if (result == 0) {
+      updateLEDs(reply[6] < 4 ? statusNames[reply[6]] : "");
+      lastVersion = getUint32(reply + 8);
+    } else if (result != 1) {
+      Serial.print("Status query failed: ");
+      Serial.println(result);
+      return false;
+    }
+    failures = 0;
+    setNextPoll(((reply[12] << 8) | reply[13]) * 100L);
+    return true;
+  }
+  Serial.println("Status query timed out");
+  return false;
+}
+
+void setNextPoll(long hintMs) {
+  if (hintMs <= 0) {
+    nextPollMs = defaultPollMs;
+  } else {
+    nextPollMs = constrain((unsigned long)hintMs, minPollMs, maxPollMs);
+  }
+}
+
+void backOff() {
+  // Exponential backoff with jitter so a server restart isn't hit by every board at once
+  if (failures < 5) {
+    failures++;
+  }
+  unsigned long backoffMs = min(defaultPollMs << failures, maxPollMs);
+  nextPollMs = backoffMs / 2 + random(0, backoffMs / 2);
 }
 
 void updateLEDs(String status) {
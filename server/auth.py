@@ -1,29 +1,22 @@
-import os
+import hashlib
+import secrets
+import time
+from collections import OrderedDict
 from datetime import datetime, timedelta
 from typing import Union, Optional
 from jose import JWTError, jwt
-from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from database import users_collection
+from database import revoked_tokens_collection
 from models import User
-from dotenv import load_dotenv
+from shared_status import status_broadcast
+from settings import (
+    SECRET_KEY, ALGORITHM, ACCESS_TOKEN_EXPIRE_MINUTES, ADMIN_USERNAME, TOKEN_CACHE_SIZE, TOKEN_CACHE_SECONDS,
+    STREAM_TICKET_SECONDS,
+)
 
-load_dotenv()
-
-SECRET_KEY = os.getenv("JWT_SECRET")
-ALGORITHM = os.getenv("ALGORITHM", "HS256")
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
-
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
-def verify_password(plain_password, hashed_password):
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password):
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -34,12 +27,92 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
+class TokenCache:
+    """Bounded cache of already verified tokens, keyed by token hash.
+
+    Entries live until the token's own exp or TOKEN_CACHE_SECONDS, whichever
+    comes first, so a revocation stored by another host is picked up within
+    that window. Revoked tokens are remembered until they would have expired
+    anyway.
+    """
+
+    def __init__(self, max_size: int = TOKEN_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._revoked = {}
+
+    @staticmethod
+    def key(token: str) -> str:
+        return hashlib.sha256(token.encode()).hexdigest()
+
+    def get(self, token: str) -> Optional[User]:
+        key = self.key(token)
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, user = entry
+        if expires_at <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return user
+
+    def set(self, token: str, expires_at: float, user: User):
+        key = self.key(token)
+        self._entries[key] = (min(expires_at, time.time() + TOKEN_CACHE_SECONDS), user)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def is_revoked(self, key: str) -> bool:
+        return key in self._revoked
+
+    def revoke(self, key: str, expires_at: float):
+        now = time.time()
+        # Forget revocations of tokens that are expired anyway
+        for revoked_key, revoked_until in list(self._revoked.items()):
+            if revoked_until <= now:
+                del self._revoked[revoked_key]
+        self._revoked[key] = expires_at
+        self._entries.pop(key, None)
+
+token_cache = TokenCache()
+admin_user = User(username=ADMIN_USERNAME, password="")
+
+async def revoke_token(token: str):
+    """Revoke on this worker, tell the other workers on this host, and store it
+    for workers on other hosts and ones that start later."""
+    try:
+        payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        return  # Invalid tokens are rejected anyway
+    key = TokenCache.key(token)
+    expires_at = payload.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60)
+    token_cache.revoke(key, expires_at)
+    if status_broadcast is not None:
+        status_broadcast.send({"type": "token_revoked", "key": key, "exp": expires_at})
+    await revoked_tokens_collection.update_one(
+        {"_id": key},
+        {"$set": {"expiresAt": datetime.utcfromtimestamp(expires_at)}},
+        upsert=True,
+    )
+
+def apply_revocation(event: dict):
+    """Revocation broadcast by another worker."""
+    token_cache.revoke(event["key"], event["exp"])
+
 async def get_current_user(token: str = Depends(oauth2_scheme)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
         headers={"WWW-Authenticate": "Bearer"},
     )
+    if (user := token_cache.get(token)) is not None:
+        return user
+    key = TokenCache.key(token)
+    if token_cache.is_revoked(key):
+        raise credentials_exception
+
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
@@ -48,9 +121,81 @@ async def get_current_user(token: str = Depends(oauth2_scheme)):
     except JWTError:
         raise credentials_exception
     
-    admin_username = os.getenv("ADMIN_USERNAME", "admin")
-    if username != admin_username:
+    if username != ADMIN_USERNAME:
         raise HTTPException(status_code=401, detail="Invalid check")  # Should catch above but safety
-    
+
+    # Revoked on another host, or before this worker started
+    if await revoked_tokens_collection.find_one({"_id": key}, {"_id": 1}) is not None:
+        token_cache.revoke(key, payload.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60))
+        raise credentials_exception
+
     # Return User object to satisfy response_model or dependency type hints
-    return User(username=admin_username, password="")
+    if "exp" in payload:
+        token_cache.set(token, payload["exp"], admin_user)
+    return admin_user
+
+class StreamSession:
+    """The login session behind an open event stream.
+
+    The stream only knows the session token's hash and exp; it asks again on
+    every heartbeat whether the session still holds.
+    """
+
+    def __init__(self, key: str, expires_at: float):
+        self.key = key
+        self.expires_at = expires_at
+        self._checked_at = 0.0  # The first call always checks Mongo
+
+    async def active(self) -> bool:
+        now = time.time()
+        if self.expires_at <= now or token_cache.is_revoked(self.key):
+            return False
+        # Revocations from other hosts are only in Mongo; look no more often than the token cache does
+        if now - self._checked_at >= TOKEN_CACHE_SECONDS:
+            if await revoked_tokens_collection.find_one({"_id": self.key}, {"_id": 1}) is not None:
+                token_cache.revoke(self.key, self.expires_at)
+                return False
+            self._checked_at = now
+        return True
+
+# jti -> exp of stream tickets already used on this worker
+used_stream_tickets = {}
+
+def create_stream_ticket(token: str) -> str:
+    """Short-lived, single-use stand-in for the bearer token in the event
+    stream URL, where access logs would record it."""
+    payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
+    ticket = {
+        "sub": payload["sub"],
+        "typ": "stream",
+        "jti": secrets.token_urlsafe(16),
+        "sid": TokenCache.key(token),
+        "sexp": payload.get("exp", time.time() + ACCESS_TOKEN_EXPIRE_MINUTES * 60),
+        "exp": datetime.utcnow() + timedelta(seconds=STREAM_TICKET_SECONDS),
+    }
+    return jwt.encode(ticket, SECRET_KEY, algorithm=ALGORITHM)
+
+async def redeem_stream_ticket(ticket: str) -> StreamSession:
+    credentials_exception = HTTPException(
+        status_code=status.HTTP_401_UNAUTHORIZED,
+        detail="Invalid or used stream ticket",
+    )
+    try:
+        payload = jwt.decode(ticket, SECRET_KEY, algorithms=[ALGORITHM])
+    except JWTError:
+        raise credentials_exception
+    if payload.get("typ") != "stream" or payload.get("sub") != ADMIN_USERNAME:
+        raise credentials_exception
+
+    now = time.time()
+    for jti, expires_at in list(used_stream_tickets.items()):
+        if expires_at <= now:
+            del used_stream_tickets[jti]
+    if payload["jti"] in used_stream_tickets:
+        raise credentials_exception
+    used_stream_tickets[payload["jti"]] = payload["exp"]
+
+    session = StreamSession(payload["sid"], payload["sexp"])
+    if not await session.active():
+        raise credentials_exception
+    return session
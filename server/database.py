@@ -1,14 +1,84 @@
-import os
+import asyncio
+import logging
+from collections import Counter
 from motor.motor_asyncio import AsyncIOMotorClient
-from dotenv import load_dotenv
+from pymongo.errors import OperationFailure
+from metrics import TimedCollection
+from settings import (
+    MONGO_URI, MONGO_MAX_POOL_SIZE, MONGO_MIN_POOL_SIZE, MONGO_MAX_IDLE_TIME_MS,
+    MONGO_CONNECT_TIMEOUT_MS, MONGO_SERVER_SELECTION_TIMEOUT_MS, MONGO_SOCKET_TIMEOUT_MS,
+    MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 
-load_dotenv()
-
-MONGO_URI = os.getenv("MONGO_URI")
-
-client = AsyncIOMotorClient(MONGO_URI)
+# connect=False: nothing is opened at import; connect() does it during startup
+client = AsyncIOMotorClient(
+    MONGO_URI,
+    connect=False,
+    maxPoolSize=MONGO_MAX_POOL_SIZE,
+    minPoolSize=MONGO_MIN_POOL_SIZE,
+    maxIdleTimeMS=MONGO_MAX_IDLE_TIME_MS,
+    connectTimeoutMS=MONGO_CONNECT_TIMEOUT_MS,
+    serverSelectionTimeoutMS=MONGO_SERVER_SELECTION_TIMEOUT_MS,
+    socketTimeoutMS=MONGO_SOCKET_TIMEOUT_MS,
+    waitQueueTimeoutMS=MONGO_WAIT_QUEUE_TIMEOUT_MS,
+)
 db = client.dinning_system
 
 # Collections
-users_collection = db["users"]
-tables_collection = db["tables"]
+users_collection = TimedCollection(db["users"])
+tables_collection = TimedCollection(db["tables"])
+status_events_collection = TimedCollection(db["status_events"])
+status_stats_collection = TimedCollection(db["status_stats"])
+devices_collection = TimedCollection(db["devices"])
+revoked_tokens_collection = TimedCollection(db["revoked_tokens"])
+
+logger = logging.getLogger(__name__)
+
+DUPLICATE_KEY = 11000
+# Table fields whose unique index could not be built because existing documents
+# (from before the index was added) repeat a value. The routes check those
+# fields themselves until the duplicates are fixed and the server restarted.
+unchecked_unique_fields = set()
+
+async def ping():
+    await db.command("ping")
+
+async def connect():
+    """Fail fast if Mongo is unreachable and open the pool's minimum connections now."""
+    await ping()
+    # Concurrent commands each need their own connection
+    await asyncio.gather(*(ping() for _ in range(MONGO_MIN_POOL_SIZE)))
+
+def close():
+    client.close()
+
+async def ensure_indexes():
+    # tableId backs the IoT lookups; both are unique so create can rely on duplicate-key errors
+    for field in ("tableId", "tableName"):
+        await ensure_unique_table_index(field)
+    await tables_collection.create_index("updatedAt")
+    # Hourly event buckets carry their own expiry time
+    await status_events_collection.create_index("expiresAt", expireAfterSeconds=0)
+    await status_stats_collection.create_index("scope")
+    # Revocations are only needed until the token would have expired anyway
+    await revoked_tokens_collection.create_index("expiresAt", expireAfterSeconds=0)
+
+async def ensure_unique_table_index(field: str):
+    try:
+        await tables_collection.create_index(field, unique=True)
+    except OperationFailure as e:
+        if e.code != DUPLICATE_KEY:
+            raise
+        duplicates = await duplicate_table_values(field)
+        logger.error(
+            "Unique index on tables.%s not created, these values are used more than once: %s. "
+            "Rename or delete the duplicates and restart; until then %s is checked before each write.",
+            field, ", ".join(f"{value!r} ({count}x)" for value, count in duplicates.items()), field,
+        )
+        unchecked_unique_fields.add(field)
+    else:
+        unchecked_unique_fields.discard(field)
+
+async def duplicate_table_values(field: str):
+    counts = Counter([table.get(field) async for table in tables_collection.find({}, {field: 1})])
+    return {value: count for value, count in counts.items() if count > 1}
@@ -1,25 +1,77 @@
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, Depends, HTTPException, status
 from fastapi.middleware.cors import CORSMiddleware
-from database import users_collection
-from models import User, UserInDB
-from auth import get_password_hash, verify_password, create_access_token, get_current_user
+from fastapi.responses import PlainTextResponse
+import database
+from models import User
+from auth import create_access_token, get_current_user, oauth2_scheme, revoke_token, apply_revocation
 from datetime import timedelta
-import os
-from dotenv import load_dotenv
+import asyncio
+import logging
+import metrics
+from settings import (
+    ACCESS_TOKEN_EXPIRE_MINUTES, ADMIN_USERNAME, ADMIN_PASSWORD, CORS_ORIGINS, CLIENT_PORT,
+    READINESS_TIMEOUT_SECONDS, STATUS_PROTOCOL_ENABLED,
+)
+from status_history import status_history
+from presence import presence
+from shared_status import shared_status, status_broadcast
+from status_protocol import status_protocol
 
 from routes import tables, iot
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+def apply_broadcast(event: dict):
+    """Events other workers on this host sent over status_broadcast."""
+    if event["type"] == "token_revoked":
+        apply_revocation(event)
+    else:
+        tables.apply_table_event(event)
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Everything a request may need is opened before uvicorn starts accepting them
+    await database.connect()
+    await database.ensure_indexes()
+    if shared_status is not None:
+        shared_status.open()
+    warmed = await iot.warm_status_cache()
+    logger.info("Status cache warmed with %d tables", warmed)
+    if status_broadcast is not None:
+        await status_broadcast.start(apply_broadcast)
+    if STATUS_PROTOCOL_ENABLED:
+        await status_protocol.start()
 
-cors_origins_str = os.getenv("CORS_ORIGINS", "")
-origins = cors_origins_str.split(",") if cors_origins_str else []
+    background_tasks = [
+        asyncio.create_task(metrics.monitor_event_loop_lag()),
+        asyncio.create_task(status_history.run()),
+        asyncio.create_task(presence.run()),
+    ]
+    app.state.ready = True
+    try:
+        yield
+    finally:
+        app.state.ready = False
+        if STATUS_PROTOCOL_ENABLED:
+            await status_protocol.close()
+        for task in background_tasks:
+            task.cancel()
+        # Let status_history and presence flush what they still hold
+        await asyncio.gather(*background_tasks, return_exceptions=True)
+        if status_broadcast is not None:
+            status_broadcast.close()
+        if shared_status is not None:
+            shared_status.close()
+        database.close()
 
-client_port = os.getenv("CLIENT_PORT")
+app = FastAPI(lifespan=lifespan)
+app.state.ready = False
 
-if client_port:
-    origins.append(f"http://localhost:{client_port}")
+origins = list(CORS_ORIGINS)
+
+if CLIENT_PORT:
+    origins.append(f"http://localhost:{CLIENT_PORT}")
 
 
 origins = list(set(origins))
@@ -34,19 +86,31 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"],
 )
-
-ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+app.add_middleware(metrics.MetricsMiddleware)
 
 @app.get("/")
 def read_root():
     return {"message": "Restaurant IoT API is running"}
 
+@app.get("/ready")
+async def read_ready():
+    """Readiness probe: startup finished, not shutting down, and Mongo answers."""
+    if not app.state.ready:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Starting up or shutting down")
+    try:
+        await asyncio.wait_for(database.ping(), READINESS_TIMEOUT_SECONDS)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_503_SERVICE_UNAVAILABLE, detail="Database unavailable")
+    return {"status": "ready"}
+
+@app.get("/metrics", response_class=PlainTextResponse)
+def read_metrics():
+    # Each uvicorn worker keeps its own metrics; scrape every worker or run one
+    return metrics.render()
+
 @app.post("/api/auth/login")
 async def login(user: User):
-    admin_username = os.getenv("ADMIN_USERNAME")
-    admin_password = os.getenv("ADMIN_PASSWORD")
-    
-    if user.username != admin_username or user.password != admin_password:
+    if user.username != ADMIN_USERNAME or user.password != ADMIN_PASSWORD:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
@@ -59,3 +123,7 @@ async def login(user: User):
     )
     return {"access_token": access_token, "token_type": "bearer"}
 
+@app.post("/api/auth/logout")
+async def logout(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)):
+    await revoke_token(token)
+    return {"message": "Logged out"}
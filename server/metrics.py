@@ -0,0 +1,218 @@
+import asyncio
+import time
+from bisect import bisect_left
+from typing import Dict, Tuple
+from settings import EVENT_LOOP_LAG_INTERVAL, METRICS_TABLE_LABELS
+
+# Seconds; tuned for an API whose hot path should answer in a few ms
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class Histogram:
+    """Prometheus-style histogram, one per label set.
+
+    Metrics are per worker process and only touched from the event loop
+    thread, so plain ints are enough and nothing on the hot path takes a lock.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        self.buckets = buckets
+        self._series: Dict[Tuple, list] = {}
+
+    def observe(self, labels: Tuple, value: float):
+        series = self._series.get(labels)
+        if series is None:
+            # per-bucket counts (+Inf last), then sum
+            series = self._series[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self, name: str, label_names: Tuple[str, ...], help_text: str):
+        lines = [f"# HELP {name} {help_text}", f"# TYPE {name} histogram"]
+        for labels, series in sorted(self._series.items()):
+            base = _labels(label_names, labels)
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), series):
+                cumulative += count
+                lines.append(f'{name}_bucket{{{base}{"," if base else ""}le="{bound}"}} {cumulative}')
+            lines.append(f"{name}_sum{{{base}}} {series[-1]}")
+            lines.append(f"{name}_count{{{base}}} {cumulative}")
+        return lines
+
+
+def _labels(names, values):
+    return ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values))
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+request_latency = Histogram()
+mongo_latency = Histogram()
+polls = 0
+table_polls: Dict[str, int] = {}
+in_flight = 0
+streams_open = 0
+status_queries_dropped = 0
+event_loop_lag = 0.0
+event_loop_lag_max = 0.0
+
+
+def record_poll(table_id: str):
+    global polls
+    polls += 1
+    if METRICS_TABLE_LABELS:
+        table_polls[table_id] = table_polls.get(table_id, 0) + 1
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware timing every HTTP request by route template.
+
+    Event streams stay open for as long as the client is connected, so they
+    are counted in streams_open instead of being timed or counted in flight.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        global in_flight, streams_open
+        status_code = 500
+        streaming = False
+        started = time.perf_counter()
+
+        async def send_wrapper(message):
+            nonlocal status_code, streaming
+            global in_flight, streams_open
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if dict(message.get("headers", ())).get(b"content-type", b"").startswith(b"text/event-stream"):
+                    streaming = True
+                    in_flight -= 1
+                    streams_open += 1
+            await send(message)
+
+        in_flight += 1
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            if streaming:
+                streams_open -= 1
+            else:
+                in_flight -= 1
+                route = getattr(scope.get("route"), "path", "<unmatched>")
+                request_latency.observe((scope["method"], route, status_code), time.perf_counter() - started)
+
+
+class TimedCursor:
+    def __init__(self, cursor, collection: str):
+        self._cursor = cursor
+        self._collection = collection
+        self._elapsed = 0.0
+
+    def sort(self, *args, **kwargs):
+        self._cursor = self._cursor.sort(*args, **kwargs)
+        return self
+
+    def limit(self, *args, **kwargs):
+        self._cursor = self._cursor.limit(*args, **kwargs)
+        return self
+
+    def skip(self, *args, **kwargs):
+        self._cursor = self._cursor.skip(*args, **kwargs)
+        return self
+
+    def __aiter__(self):
+        self._cursor = self._cursor.__aiter__()
+        return self
+
+    async def __anext__(self):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.__anext__()
+        except StopAsyncIteration:
+            mongo_latency.observe((self._collection, "find"), self._elapsed + time.perf_counter() - started)
+            raise
+        finally:
+            self._elapsed += time.perf_counter() - started
+
+    async def to_list(self, length=None):
+        started = time.perf_counter()
+        try:
+            return await self._cursor.to_list(length)
+        finally:
+            mongo_latency.observe((self._collection, "find"), time.perf_counter() - started)
+
+
+class TimedCollection:
+    """Wraps a Motor collection and times each awaited operation."""
+
+    def __init__(self, collection):
+        self.collection = collection
+        self.name = collection.name
+
+    def find(self, *args, **kwargs):
+        return TimedCursor(self.collection.find(*args, **kwargs), self.name)
+
+    def __getattr__(self, operation):
+        method = getattr(self.collection, operation)
+        if not callable(method):
+            return method
+
+        async def timed(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                mongo_latency.observe((self.name, operation), time.perf_counter() - started)
+
+        # Cache the wrapper so later lookups skip __getattr__
+        setattr(self, operation, timed)
+        return timed
+
+
+async def monitor_event_loop_lag():
+    """Measure how late the loop wakes us up; a busy loop delays every poll."""
+    global event_loop_lag, event_loop_lag_max
+    loop = asyncio.get_running_loop()
+    while True:
+        started = loop.time()
+        await asyncio.sleep(EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag = max(0.0, loop.time() - started - EVENT_LOOP_LAG_INTERVAL)
+        event_loop_lag_max = max(event_loop_lag_max, event_loop_lag)
+
+
+def render() -> str:
+    lines = request_latency.render(
+        "http_request_duration_seconds", ("method", "route", "status"), "HTTP request latency by route"
+    )
+    lines += mongo_latency.render(
+        "mongo_operation_duration_seconds", ("collection", "operation"), "MongoDB operation latency"
+    )
+    lines += ["# HELP http_requests_in_flight Requests currently being served",
+              "# TYPE http_requests_in_flight gauge",
+              f"http_requests_in_flight {in_flight}",
+              "# HELP http_streams_open Event streams currently connected",
+              "# TYPE http_streams_open gauge",
+              f"http_streams_open {streams_open}",
+              "# HELP status_protocol_dropped_total UDP status queries dropped while too many lookups were pending",
+              "# TYPE status_protocol_dropped_total counter",
+              f"status_protocol_dropped_total {status_queries_dropped}"]
+    lines += ["# HELP iot_polls_total Status polls from devices",
+              "# TYPE iot_polls_total counter",
+              f"iot_polls_total {polls}"]
+    if METRICS_TABLE_LABELS:
+        lines += ["# HELP iot_table_polls_total Status polls per table",
+                  "# TYPE iot_table_polls_total counter"]
+        lines += [f'iot_table_polls_total{{tableId="{_escape(t)}"}} {n}' for t, n in sorted(table_polls.items())]
+    lines += ["# HELP event_loop_lag_seconds Last measured event loop lag",
+              "# TYPE event_loop_lag_seconds gauge",
+              f"event_loop_lag_seconds {event_loop_lag}",
+              "# HELP event_loop_lag_max_seconds Worst event loop lag since start",
+              "# TYPE event_loop_lag_max_seconds gauge",
+              f"event_loop_lag_max_seconds {event_loop_lag_max}"]
+    return "\n".join(lines) + "\n"
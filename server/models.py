@@ -1,5 +1,5 @@
 from pydantic import BaseModel, Field, ConfigDict, GetCoreSchemaHandler, GetJsonSchemaHandler
-from typing import Optional, Any, List
+from typing import Optional, Any, List, Dict
 from datetime import datetime
 from bson import ObjectId
 from pydantic_core import CoreSchema, core_schema
@@ -48,6 +48,8 @@ class TableModel(BaseModel):
     tableName: str
     status: str = "idle"  # idle, placed, processing, delivered
     isActive: bool = True
+    version: int = 0
+    statusSince: Optional[datetime] = None
     createdAt: datetime = Field(default_factory=datetime.now)
     updatedAt: datetime = Field(default_factory=datetime.now)
 
@@ -68,5 +70,37 @@ class TableUpdate(BaseModel):
     isActive: Optional[bool] = None
     updatedAt: datetime = Field(default_factory=datetime.now)
 
+class TableBulkUpdate(BaseModel):
+    id: str
+    tableName: Optional[str] = None
+    status: Optional[str] = None
+    isActive: Optional[bool] = None
+
+class TableBulkFilter(BaseModel):
+    ids: Optional[List[str]] = None
+    status: Optional[str] = None
+    isActive: Optional[bool] = None
+
+class TableBulkRequest(BaseModel):
+    # Either per-table changes, or one change applied to every table matching filter
+    updates: List[TableBulkUpdate] = Field(default=[], max_length=500)
+    filter: Optional[TableBulkFilter] = None
+    set: Optional[TableUpdate] = None
+
+class TableBulkError(BaseModel):
+    id: str
+    detail: str
+
+class TableBulkResult(BaseModel):
+    tables: List[TableModel]
+    errors: List[TableBulkError] = []
+
 class IOTRequest(BaseModel):
     tableId: str
+    version: Optional[int] = None  # last version the device saw
+    firmware: Optional[str] = None
+
+class IOTBatchRequest(BaseModel):
+    tableIds: List[str] = Field(max_length=256)
+    versions: Dict[str, int] = {}  # tableId -> last version the gateway saw
+    firmware: Optional[str] = None
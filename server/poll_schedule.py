@@ -0,0 +1,72 @@
+import random
+import time
+from collections import deque
+from typing import Deque, Dict, Optional
+from status_cache import TableStatus
+from settings import (
+    POLL_MIN_MS, POLL_MAX_MS, POLL_INACTIVE_MS, POLL_JITTER, POLL_RECENT_CHANGE_SECONDS,
+    POLL_LOAD_LAG_SECONDS, POLL_MAX_BACKOFF,
+)
+import metrics
+
+# Base interval per status: an order in the kitchen is about to move, an idle
+# table can wait until a waiter places something
+STATUS_POLL_MS = {
+    "placed": 3000,
+    "processing": 2000,
+    "delivered": 10000,
+    "idle": 30000,
+}
+DEFAULT_POLL_MS = 5000
+CHANGE_HISTORY = 4
+
+
+class PollScheduler:
+    """Computes the nextPollMs hint returned to polling devices.
+
+    The interval starts from the table's status, shrinks when the table changed
+    recently, grows while this worker is under load and is jittered so boards
+    that were power cycled together drift apart instead of polling in lockstep.
+    """
+
+    def __init__(self):
+        self._changes: Dict[str, Deque[float]] = {}
+
+    def record_change(self, table_id: str):
+        changes = self._changes.get(table_id)
+        if changes is None:
+            changes = self._changes[table_id] = deque(maxlen=CHANGE_HISTORY)
+        changes.append(time.monotonic())
+
+    def forget(self, table_id: str):
+        self._changes.pop(table_id, None)
+
+    def recent_changes(self, table_id: str, now: Optional[float] = None) -> int:
+        changes = self._changes.get(table_id)
+        if not changes:
+            return 0
+        now = time.monotonic() if now is None else now
+        return sum(1 for at in changes if now - at <= POLL_RECENT_CHANGE_SECONDS)
+
+    def load_factor(self) -> float:
+        # Event-loop lag is what actually delays answers. Request counts are
+        # not: open event streams sit in them while costing nothing.
+        return min(POLL_MAX_BACKOFF, max(1.0, metrics.event_loop_lag / POLL_LOAD_LAG_SECONDS))
+
+    def interval_ms(self, table_id: str, table: TableStatus) -> float:
+        """The hint before jitter."""
+        if not table.isActive:
+            interval = POLL_INACTIVE_MS
+        else:
+            interval = STATUS_POLL_MS.get(table.status, DEFAULT_POLL_MS)
+            # Halve per recent change, so a busy table converges on POLL_MIN_MS
+            interval /= 2 ** self.recent_changes(table_id)
+        return interval * self.load_factor()
+
+    def next_poll_ms(self, table_id: str, table: TableStatus) -> int:
+        interval = self.interval_ms(table_id, table)
+        interval *= random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+        return int(min(POLL_MAX_MS, max(POLL_MIN_MS, interval)))
+
+
+poll_scheduler = PollScheduler()
@@ -0,0 +1,99 @@
+import asyncio
+import logging
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+from pymongo import UpdateOne
+from database import devices_collection
+from settings import PRESENCE_FLUSH_SECONDS, DEVICE_ONLINE_SECONDS, DEVICE_OFFLINE_SECONDS
+
+logger = logging.getLogger(__name__)
+
+
+class PresenceTracker:
+    """Remembers when each table's board last polled.
+
+    Polls only touch an in-memory dict; a background task writes the tables
+    seen since the last flush to the devices collection in one bulk_write.
+    """
+
+    def __init__(self):
+        self._devices: Dict[str, dict] = {}
+        self._dirty = set()
+
+    def seen(self, table_id: str, ip: Optional[str] = None, firmware: Optional[str] = None):
+        device = self._devices.get(table_id)
+        if device is None:
+            device = self._devices[table_id] = {"tableId": table_id, "polls": 0}
+        device["lastSeen"] = datetime.now()
+        device["polls"] += 1
+        if ip:
+            device["ip"] = ip
+        if firmware:
+            device["firmware"] = firmware
+        self._dirty.add(table_id)
+
+    def local(self) -> Dict[str, dict]:
+        return self._devices
+
+    def forget(self, table_id: str):
+        self._devices.pop(table_id, None)
+        self._dirty.discard(table_id)
+
+    async def flush(self):
+        if not self._dirty:
+            return
+        dirty, self._dirty = self._dirty, set()
+        operations = []
+        flushed_polls = {}
+        for table_id in dirty:
+            device = self._devices.get(table_id)
+            if device is None:
+                continue
+            fields = {k: device[k] for k in ("ip", "firmware") if k in device}
+            update = {
+                "$max": {"lastSeen": device["lastSeen"]},
+                "$inc": {"polls": device["polls"]},
+                "$setOnInsert": {"tableId": table_id},
+            }
+            if fields:
+                update["$set"] = fields
+            operations.append(UpdateOne({"_id": table_id}, update, upsert=True))
+            # polls is flushed as a delta so workers can add theirs up
+            flushed_polls[table_id] = device["polls"]
+            device["polls"] = 0
+        if not operations:
+            return
+        try:
+            await devices_collection.bulk_write(operations, ordered=False)
+        except Exception:
+            # Keep them for the next flush, on top of polls counted meanwhile.
+            # As with status history, a partly applied batch may count twice.
+            for table_id, polls in flushed_polls.items():
+                device = self._devices.get(table_id)
+                if device is not None:
+                    device["polls"] += polls
+                    self._dirty.add(table_id)
+            raise
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(PRESENCE_FLUSH_SECONDS)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Presence flush failed")
+        finally:
+            await self.flush()
+
+
+def device_state(last_seen: datetime, now: datetime) -> str:
+    age = now - last_seen
+    if age <= timedelta(seconds=DEVICE_ONLINE_SECONDS):
+        return "online"
+    if age <= timedelta(seconds=DEVICE_OFFLINE_SECONDS):
+        return "stale"
+    return "offline"
+
+
+presence = PresenceTracker()
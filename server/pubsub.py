@@ -0,0 +1,106 @@
+import asyncio
+import json
+import time
+from collections import OrderedDict
+from typing import Dict, List, Optional, Set
+from settings import STREAM_HEARTBEAT_SECONDS
+
+# Topic used by subscribers that want every table (the chef dashboard)
+ALL_TABLES = None
+
+
+class Subscription:
+    """One connected client.
+
+    Pending events are keyed by tableId, so a consumer that falls behind only
+    ever holds the latest event per table instead of an unbounded backlog.
+    """
+
+    def __init__(self, topic: Optional[str]):
+        self.topic = topic
+        self._pending: "OrderedDict[str, dict]" = OrderedDict()
+        self._ready = asyncio.Event()
+
+    def push(self, table_id: str, event: dict):
+        self._pending.pop(table_id, None)
+        self._pending[table_id] = event
+        self._ready.set()
+
+    async def next_batch(self, timeout: float) -> List[dict]:
+        """Wait for events; returns an empty list when the heartbeat is due."""
+        if not self._pending:
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                return []
+        batch = list(self._pending.values())
+        self._pending.clear()
+        self._ready.clear()
+        return batch
+
+
+class StatusHub:
+    """In-process pub/sub for table changes."""
+
+    def __init__(self):
+        self._subscribers: Dict[Optional[str], Set[Subscription]] = {}
+
+    def subscriber_count(self) -> int:
+        return sum(len(subs) for subs in self._subscribers.values())
+
+    def subscribe(self, topic: Optional[str] = ALL_TABLES) -> Subscription:
+        subscription = Subscription(topic)
+        self._subscribers.setdefault(topic, set()).add(subscription)
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        subs = self._subscribers.get(subscription.topic)
+        if subs is None:
+            return
+        subs.discard(subscription)
+        if not subs:
+            del self._subscribers[subscription.topic]
+
+    def publish(self, table_id: str, event: dict):
+        for topic in (table_id, ALL_TABLES):
+            for subscription in self._subscribers.get(topic, ()):
+                subscription.push(table_id, event)
+
+
+status_hub = StatusHub()
+
+
+async def event_stream(subscription: Subscription, format_event, initial: Optional[List[dict]] = None,
+                       on_heartbeat=None, still_authorized=None):
+    """Server-Sent Events body for a subscription, with heartbeats.
+
+    still_authorized, if given, is awaited at least once per heartbeat interval,
+    before whatever is sent next, busy or idle; once it returns False the stream
+    sends an "expired" event and ends.
+    """
+    checked_at = time.monotonic()
+    try:
+        for event in initial or ():
+            yield f"data: {json.dumps(format_event(event))}\n\n"
+        while True:
+            batch = await subscription.next_batch(STREAM_HEARTBEAT_SECONDS)
+            due = not batch or time.monotonic() - checked_at >= STREAM_HEARTBEAT_SECONDS
+            if still_authorized is not None and due:
+                if not await still_authorized():
+                    yield "event: expired\ndata: {}\n\n"
+                    return
+                checked_at = time.monotonic()
+            if not batch:
+                if on_heartbeat is not None:
+                    on_heartbeat()
+                yield ": ping\n\n"
+                continue
+            yield "".join(f"data: {json.dumps(format_event(event))}\n\n" for event in batch)
+    finally:
+        status_hub.unsubscribe(subscription)
+
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "X-Accel-Buffering": "no",
+}
@@ -1,16 +1,170 @@
-from fastapi import APIRouter, HTTPException
-from database import tables_collection
-from models import IOTRequest
+from fastapi import APIRouter, Depends, HTTPException, Header, Request, Response
+from fastapi.responses import StreamingResponse
+from typing import Optional, Dict, List
+from datetime import datetime
+from database import tables_collection, devices_collection
+from models import IOTRequest, IOTBatchRequest, User
+from auth import get_current_user
+from presence import presence, device_state
+from poll_schedule import poll_scheduler, DEFAULT_POLL_MS
+from status_cache import status_cache, TableStatus
+from shared_status import shared_status
+from pubsub import status_hub, event_stream, SSE_HEADERS
+import metrics
 
 router = APIRouter(
     prefix="/api/iot",
     tags=["iot"],
 )
 
-@router.post("/table-status")
-async def get_table_status(request: IOTRequest):
-    table = await tables_collection.find_one({"tableId": request.tableId})
+STATUS_PROJECTION = {"_id": 0, "tableId": 1, "status": 1, "version": 1, "isActive": 1}
+
+def cached_table_status(table_id: str) -> Optional[TableStatus]:
+    # The host-wide shared table is cleared on each server start and written by
+    # every worker, so it is as fresh as this worker's own cache
+    if shared_status is not None and (shared := shared_status.get(table_id)) is not None:
+        return shared
+    return status_cache.get(table_id)
+
+def remember_table_status(table: dict) -> TableStatus:
+    entry = status_cache.set_from_document(table)
+    if shared_status is not None:
+        shared_status.set(table["tableId"], entry)
+    return entry
+
+async def lookup_table_status(table_id: str):
+    cached = cached_table_status(table_id)
+    if cached is not None:
+        return cached
+
+    table = await tables_collection.find_one({"tableId": table_id}, STATUS_PROJECTION)
     if not table:
+        return None
+    return remember_table_status(table)
+
+async def lookup_table_statuses(table_ids: List[str]) -> Dict[str, TableStatus]:
+    """Resolve many tables with one cache pass and at most one $in query."""
+    found = {}
+    misses = []
+    for table_id in table_ids:
+        cached = cached_table_status(table_id)
+        if cached is not None:
+            found[table_id] = cached
+        else:
+            misses.append(table_id)
+
+    if misses:
+        async for table in tables_collection.find({"tableId": {"$in": misses}}, STATUS_PROJECTION):
+            found[table["tableId"]] = remember_table_status(table)
+    return found
+
+async def warm_status_cache() -> int:
+    """Load the most recently updated tables before the app takes traffic, so
+    the first polls after a deploy are answered from the cache."""
+    warmed = 0
+    cursor = tables_collection.find({}, STATUS_PROJECTION).sort("updatedAt", -1).limit(status_cache.max_size)
+    async for table in cursor:
+        remember_table_status(table)
+        warmed += 1
+    return warmed
+
+def client_ip(request: Request) -> Optional[str]:
+    return request.client.host if request.client else None
+
+def record_device_poll(table_id: str, table: TableStatus, ip: Optional[str], firmware: Optional[str] = None) -> int:
+    """Bookkeeping shared by every way a device can poll; returns the nextPollMs hint."""
+    metrics.record_poll(table_id)
+    presence.seen(table_id, ip, firmware)
+    return poll_scheduler.next_poll_ms(table_id, table)
+
+@router.post("/table-status")
+async def get_table_status(
+    request: IOTRequest,
+    http_request: Request,
+    response: Response,
+    if_none_match: Optional[str] = Header(default=None),
+):
+    table = await lookup_table_status(request.tableId)
+    if table is None:
         raise HTTPException(status_code=404, detail="Table not found")
-    
-    return {"status": table["status"]}
+    next_poll_ms = record_device_poll(request.tableId, table, client_ip(http_request), request.firmware)
+
+    # A 304 has no body, so the hint also travels as a header
+    headers = {"ETag": table.etag, "X-Next-Poll-Ms": str(next_poll_ms)}
+
+    # Devices can send back either the version field or the ETag header
+    if request.version == table.version or if_none_match == table.etag:
+        return Response(status_code=304, headers=headers)
+
+    response.headers.update(headers)
+    return {"status": table.status, "version": table.version, "nextPollMs": next_poll_ms}
+
+@router.post("/table-status/batch")
+async def get_table_statuses(request: IOTBatchRequest, http_request: Request):
+    tables = await lookup_table_statuses(request.tableIds)
+    ip = client_ip(http_request)
+    # The gateway polls for all of its tables at once, so the busiest one sets the pace
+    next_poll_ms = min(
+        (record_device_poll(table_id, table, ip, request.firmware) for table_id, table in tables.items()),
+        default=DEFAULT_POLL_MS,
+    )
+
+    # Only tables whose version moved since the gateway last looked are returned
+    changed = {
+        table_id: {"status": table.status, "version": table.version}
+        for table_id, table in tables.items()
+        if request.versions.get(table_id) != table.version
+    }
+    missing = [table_id for table_id in request.tableIds if table_id not in tables]
+    return {"tables": changed, "missing": missing, "nextPollMs": next_poll_ms}
+
+def device_event(event: dict):
+    table = event["table"]
+    if event["type"] == "deleted":
+        return {"deleted": True}
+    return {"status": table["status"], "version": table["version"]}
+
+@router.get("/events/{table_id}")
+async def stream_table_status(table_id: str, http_request: Request, firmware: Optional[str] = None):
+    table = await lookup_table_status(table_id)
+    if table is None:
+        raise HTTPException(status_code=404, detail="Table not found")
+
+    ip = client_ip(http_request)
+    presence.seen(table_id, ip, firmware)
+    subscription = status_hub.subscribe(table_id)
+    initial = [{"type": "updated", "table": {"status": table.status, "version": table.version}}]
+    return StreamingResponse(
+        # A connected stream counts as alive; heartbeats keep lastSeen fresh
+        event_stream(subscription, device_event, initial, lambda: presence.seen(table_id, ip, firmware)),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
+
+@router.get("/devices")
+async def get_devices(current_user: User = Depends(get_current_user)):
+    """Boards grouped into online, stale and offline by when they last polled."""
+    devices = {device["tableId"]: device async for device in devices_collection.find({}, {"_id": 0})}
+    # This worker's polls may not be flushed yet
+    for table_id, local in presence.local().items():
+        device = devices.setdefault(table_id, {"tableId": table_id, "polls": 0})
+        if device.get("lastSeen") is None or local["lastSeen"] > device["lastSeen"]:
+            device["lastSeen"] = local["lastSeen"]
+            device.update({k: local[k] for k in ("ip", "firmware") if k in local})
+        device["polls"] = device.get("polls", 0) + local["polls"]
+
+    names = {
+        table["tableId"]: table["tableName"]
+        async for table in tables_collection.find(
+            {"tableId": {"$in": list(devices)}}, {"_id": 0, "tableId": 1, "tableName": 1}
+        )
+    }
+    now = datetime.now()
+    grouped = {"online": [], "stale": [], "offline": []}
+    for table_id, device in sorted(devices.items()):
+        if table_id not in names:
+            continue  # Table was deleted
+        device["tableName"] = names[table_id]
+        device["secondsSinceSeen"] = int((now - device["lastSeen"]).total_seconds())
+        grouped[device_state(device["lastSeen"], now)].append(device)
+    return grouped
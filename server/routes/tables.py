@@ -1,10 +1,23 @@
-from fastapi import APIRouter, Depends, HTTPException, status
-from typing import List
-from database import tables_collection
-from models import TableModel, TableCreate, TableUpdate, User
-from auth import get_current_user
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import StreamingResponse
+from typing import List, Optional
+from models import TableModel, TableCreate, TableUpdate, User, TableBulkRequest, TableBulkResult
+from auth import get_current_user, oauth2_scheme, create_stream_ticket, redeem_stream_ticket
+from status_cache import status_cache, TableStatus
+from shared_status import shared_status, status_broadcast
+from pubsub import status_hub, event_stream, SSE_HEADERS, ALL_TABLES
+from status_history import status_history, summarize_stats
+from database import tables_collection, status_stats_collection, devices_collection, unchecked_unique_fields
+from presence import presence
+from poll_schedule import poll_scheduler
 from bson import ObjectId
-from datetime import datetime
+from pymongo import ReturnDocument, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError
+from datetime import datetime, timedelta
+from contextlib import contextmanager
+from settings import SYNC_CURSOR_LAG_SECONDS, STREAM_TICKET_SECONDS, TABLE_WRITE_TIMEOUT_SECONDS
+import json
+import pymongo
 import random
 import string
 
@@ -14,67 +27,327 @@ router = APIRouter(
     responses={404: {"description": "Not found"}},
 )
 
+def apply_table_event(event: dict):
+    """Refresh this worker's cache and stream subscribers; also used for
+    events broadcast by the other workers."""
+    table = event["table"]
+    if event["type"] == "deleted":
+        status_cache.invalidate(table["tableId"])
+        poll_scheduler.forget(table["tableId"])
+    else:
+        status_cache.set_from_document(table)
+        poll_scheduler.record_change(table["tableId"])
+    status_hub.publish(table["tableId"], event)
+
+def publish_table(table: dict):
+    event = {
+        "type": "updated",
+        "table": TableModel(**table).model_dump(mode="json", by_alias=True),
+    }
+    if shared_status is not None:
+        entry = TableStatus(table["status"], table.get("version", 0), table.get("isActive", True))
+        shared_status.set(table["tableId"], entry)
+        status_broadcast.send(event)
+    apply_table_event(event)
+
+def publish_table_deleted(table: dict):
+    event = {
+        "type": "deleted",
+        "table": {"_id": str(table["_id"]), "tableId": table["tableId"]},
+    }
+    if shared_status is not None:
+        shared_status.delete(table["tableId"])
+        status_broadcast.send(event)
+    apply_table_event(event)
+
+def generate_table_id():
+    # 3 letters, 3 numbers, shuffled
+    letters = random.choices(string.ascii_uppercase, k=3)
+    numbers = random.choices(string.digits, k=3)
+    combined = letters + numbers
+    random.shuffle(combined)
+    return "".join(combined)
+
+def is_duplicate(error: DuplicateKeyError, field: str):
+    details = error.details or {}
+    if "keyPattern" in details:
+        return field in details["keyPattern"]
+    return f"{field}_1" in details.get("errmsg", "")
+
+async def is_taken(field: str, value, exclude_id: Optional[ObjectId] = None):
+    # Normally the unique index answers this; see database.ensure_unique_table_index
+    if field not in unchecked_unique_fields:
+        return False
+    query = {field: value}
+    if exclude_id is not None:
+        query["_id"] = {"$ne": exclude_id}
+    return await tables_collection.find_one(query, {"_id": 1}) is not None
+
+@contextmanager
+def stamped_write():
+    """updatedAt for a table write, run with a deadline.
+
+    The stamp is taken before the write commits, so GET /api/tables?since=
+    cursors trail the clock by SYNC_CURSOR_LAG_SECONDS. The deadline is what
+    bounds that gap: MongoDB abandons a write still running when it passes.
+    """
+    with pymongo.timeout(TABLE_WRITE_TIMEOUT_SECONDS):
+        yield datetime.now()
+
+TABLE_FIELDS = ("tableId", "tableName", "status", "isActive", "version", "statusSince", "createdAt", "updatedAt")
+# What status history needs to close the previous status
+HISTORY_PROJECTION = {"tableId": 1, "status": 1, "statusSince": 1}
+TABLE_DEFAULTS = {"status": "idle", "isActive": True, "version": 0}
+STREAM_CHUNK_SIZE = 100
+
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"{type(value).__name__} is not JSON serializable")
+
+def table_json(table: dict, fields: Optional[List[str]]):
+    # Same shape TableModel would produce, without running validation per row
+    table = {"_id": table["_id"], **{k: table.get(k, TABLE_DEFAULTS.get(k)) for k in fields or TABLE_FIELDS}}
+    return json.dumps(table, default=json_default)
+
+async def stream_json_array(cursor, fields: Optional[List[str]]):
+    yield "["
+    chunk = []
+    first = True
+    async for table in cursor:
+        chunk.append(table_json(table, fields))
+        if len(chunk) >= STREAM_CHUNK_SIZE:
+            yield ("" if first else ",") + ",".join(chunk)
+            first = False
+            chunk = []
+    if chunk:
+        yield ("" if first else ",") + ",".join(chunk)
+    yield "]"
+
 @router.get("/", response_model=List[TableModel])
-async def get_tables(current_user: User = Depends(get_current_user)):
-    tables = []
-    async for table in tables_collection.find():
-        tables.append(table)
-    return tables
+async def get_tables(
+    since: Optional[datetime] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(default=None, ge=1, le=500),
+    fields: Optional[str] = None,
+    current_user: User = Depends(get_current_user),
+):
+    """List tables as a streamed JSON array.
+
+    - since: only tables updated at or after this time; pass back the
+      X-Sync-Cursor header of the previous response. The cursor trails the
+      clock, so a delta may repeat recently changed tables. Deletions are not
+      reported here, they come through /api/tables/events.
+    - after/limit: keyset pagination by _id; pass the last _id seen as after.
+    - fields: comma-separated projection, _id is always included.
+    """
+    # Taken before the query runs: writes that commit during it are picked up next time
+    sync_cursor = datetime.now() - timedelta(seconds=SYNC_CURSOR_LAG_SECONDS)
+    query = {}
+    if since is not None:
+        query["updatedAt"] = {"$gte": since}
+    if after is not None:
+        if not ObjectId.is_valid(after):
+            raise HTTPException(status_code=400, detail="Invalid cursor")
+        query["_id"] = {"$gt": ObjectId(after)}
+
+    projection = None
+    field_list = None
+    if fields:
+        field_list = [f.strip() for f in fields.split(",") if f.strip()]
+        unknown = [f for f in field_list if f not in TABLE_FIELDS]
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(unknown)}")
+        projection = {f: 1 for f in field_list}
+
+    cursor = tables_collection.find(query, projection)
+    if after is not None or limit is not None:
+        cursor = cursor.sort("_id", 1)
+    if limit is not None:
+        cursor = cursor.limit(limit)
+
+    return StreamingResponse(
+        stream_json_array(cursor, field_list),
+        media_type="application/json",
+        headers={"X-Sync-Cursor": sync_cursor.isoformat()},
+    )
 
 @router.post("/", response_model=TableModel)
 async def create_table(table: TableCreate, current_user: User = Depends(get_current_user)):
-    # Check if table name already exists
-    if await tables_collection.find_one({"tableName": table.tableName}):
+    new_table_dict = table.dict()
+    if await is_taken("tableName", table.tableName):
         raise HTTPException(status_code=400, detail="Table name already exists")
-        
-    # Generate random ID: 3 letters, 3 numbers, shuffled
-    while True:
-        letters = ''.join(random.choices(string.ascii_uppercase, k=3))
-        numbers = ''.join(random.choices(string.digits, k=3))
-        combined = list(letters + numbers)
-        random.shuffle(combined)
-        table_id = "".join(combined)
-        
-        # Check uniqueness
-        if not await tables_collection.find_one({"tableId": table_id}):
-            break
 
-    new_table_dict = table.dict()
-    new_table_dict["tableId"] = table_id
-    new_table_dict["createdAt"] = datetime.now()
-    new_table_dict["updatedAt"] = datetime.now()
-
-    # Create TableModel instance to validate (including default fields like _id)
-    # Actually simpler to just insert dict if we handle _id manually or let mongo do it.
-    # But TableModel has default factory for _id (PyObjectId).
-    
-    # Let's align with Pydantic model
-    validated_table = TableModel(**new_table_dict)
-    
-    # Exclude _id so Mongo generates it as ObjectId, avoiding string/ObjectId mismatch if Pydantic serialized it
-    insert_data = validated_table.dict(by_alias=True, exclude={"id"})
-    
-    new_table = await tables_collection.insert_one(insert_data)
-    created_table = await tables_collection.find_one({"_id": new_table.inserted_id})
+    with stamped_write() as now:
+        new_table_dict["createdAt"] = now
+        new_table_dict["updatedAt"] = now
+        new_table_dict["statusSince"] = now
+
+        # The unique indexes on tableName and tableId do the uniqueness checks, so
+        # the normal case is a single insert; only a tableId collision retries.
+        while True:
+            new_table_dict["tableId"] = generate_table_id()
+            if await is_taken("tableId", new_table_dict["tableId"]):
+                continue
+            validated_table = TableModel(**new_table_dict)
+            # Exclude _id so Mongo generates it as ObjectId, avoiding string/ObjectId mismatch if Pydantic serialized it
+            created_table = validated_table.dict(by_alias=True, exclude={"id"})
+            try:
+                new_table = await tables_collection.insert_one(created_table)
+                break
+            except DuplicateKeyError as e:
+                if is_duplicate(e, "tableName"):
+                    raise HTTPException(status_code=400, detail="Table name already exists")
+                if not is_duplicate(e, "tableId"):
+                    raise
+
+    created_table["_id"] = new_table.inserted_id
+    publish_table(created_table)
     return created_table
 
+def bulk_write_detail(error: dict):
+    if error.get("code") == 11000:
+        return "Table name already exists"
+    return error.get("errmsg", "Update failed")
+
+@router.post("/bulk", response_model=TableBulkResult)
+async def bulk_update_tables(request: TableBulkRequest, current_user: User = Depends(get_current_user)):
+    """Apply many table changes with one write.
+
+    Either send per-table `updates`, or a `filter` plus the `set` to apply to
+    every matching table (e.g. reset a whole section to idle).
+    """
+    if request.updates and request.filter is not None:
+        raise HTTPException(status_code=400, detail="Send either updates or filter, not both")
+
+    errors = []
+    ids = []
+    with stamped_write() as now:
+
+        if request.filter is not None:
+            if request.set is None:
+                raise HTTPException(status_code=400, detail="filter requires set")
+            update_data = request.set.dict(exclude_unset=True)
+            if not update_data:
+                raise HTTPException(status_code=400, detail="Nothing to update")
+            if "tableName" in update_data:
+                raise HTTPException(status_code=400, detail="tableName must be unique, rename tables through updates")
+            update_data["updatedAt"] = now
+            if "status" in update_data:
+                update_data["statusSince"] = now
+
+            query = {}
+            if request.filter.ids is not None:
+                errors.extend(
+                    {"id": i, "detail": "Invalid ID format"} for i in request.filter.ids if not ObjectId.is_valid(i)
+                )
+                query["_id"] = {"$in": [ObjectId(i) for i in request.filter.ids if ObjectId.is_valid(i)]}
+            if request.filter.status is not None:
+                query["status"] = request.filter.status
+            if request.filter.isActive is not None:
+                query["isActive"] = request.filter.isActive
+
+            # Resolve the matching ids first so the result is exactly the tables we touched
+            before = {table["_id"]: table async for table in tables_collection.find(query, HISTORY_PROJECTION)}
+            ids = list(before)
+            if ids:
+                await tables_collection.update_many(
+                    {"_id": {"$in": ids}}, {"$set": update_data, "$inc": {"version": 1}}
+                )
+        else:
+            operations = []
+            operation_ids = []
+            changes_status = False
+            for item in request.updates:
+                update_data = item.dict(exclude={"id"}, exclude_unset=True)
+                if not ObjectId.is_valid(item.id):
+                    errors.append({"id": item.id, "detail": "Invalid ID format"})
+                elif not update_data:
+                    errors.append({"id": item.id, "detail": "Nothing to update"})
+                elif "tableName" in update_data and await is_taken(
+                    "tableName", update_data["tableName"], ObjectId(item.id)
+                ):
+                    errors.append({"id": item.id, "detail": "Table name already exists"})
+                else:
+                    update_data["updatedAt"] = now
+                    if "status" in update_data:
+                        update_data["statusSince"] = now
+                        changes_status = True
+                    operations.append(UpdateOne(
+                        {"_id": ObjectId(item.id)}, {"$set": update_data, "$inc": {"version": 1}}
+                    ))
+                    operation_ids.append(item.id)
+
+            before = {}
+            if changes_status:
+                before = {
+                    table["_id"]: table
+                    async for table in tables_collection.find(
+                        {"_id": {"$in": [ObjectId(i) for i in operation_ids]}}, HISTORY_PROJECTION
+                    )
+                }
+
+            failed = set()
+            if operations:
+                try:
+                    await tables_collection.bulk_write(operations, ordered=False)
+                except BulkWriteError as e:
+                    for error in e.details.get("writeErrors", []):
+                        item_id = operation_ids[error["index"]]
+                        failed.add(item_id)
+                        errors.append({"id": item_id, "detail": bulk_write_detail(error)})
+            ids = [ObjectId(i) for i in operation_ids if i not in failed]
+
+    tables = []
+    if ids:
+        async for table in tables_collection.find({"_id": {"$in": ids}}):
+            publish_table(table)
+            if table["_id"] in before:
+                status_history.record(before[table["_id"]], table, now)
+            tables.append(table)
+
+    found = {str(table["_id"]) for table in tables}
+    for table_id in ids:
+        if str(table_id) not in found:
+            errors.append({"id": str(table_id), "detail": "Table not found"})
+
+    return {"tables": tables, "errors": errors}
+
 @router.put("/{id}", response_model=TableModel)
 async def update_table(id: str, table_update: TableUpdate, current_user: User = Depends(get_current_user)):
     if not ObjectId.is_valid(id):
         raise HTTPException(status_code=400, detail="Invalid ID format") # Should catch early but good for safety
         
     update_data = {k: v for k, v in table_update.dict(exclude_unset=True).items()}
-    
+
+    if "tableName" in update_data and await is_taken("tableName", update_data["tableName"], ObjectId(id)):
+        raise HTTPException(status_code=400, detail="Table name already exists")
+
     if len(update_data) >= 1:
-        update_result = await tables_collection.update_one(
-            {"_id": ObjectId(id)}, {"$set": update_data}
-        )
-        if update_result.modified_count == 0:
-             # Check if it exists but wasn't modified (rare but possible if same data sent)
-             # or if it doesn't exist.
-             existing = await tables_collection.find_one({"_id": ObjectId(id)})
-             if not existing:
-                 raise HTTPException(status_code=404, detail="Table not found")
+        # Always stamp server time, it is the cursor for GET /api/tables?since=
+        with stamped_write() as now:
+            update_data["updatedAt"] = now
+            if "status" in update_data:
+                # Written with the status itself so every worker and subscriber sees it at once
+                update_data["statusSince"] = now
+            try:
+                # One round trip; the previous document feeds the status history
+                previous = await tables_collection.find_one_and_update(
+                    {"_id": ObjectId(id)},
+                    {"$set": update_data, "$inc": {"version": 1}},
+                    return_document=ReturnDocument.BEFORE,
+                )
+            except DuplicateKeyError:
+                raise HTTPException(status_code=400, detail="Table name already exists")
+        if previous is None:
+            raise HTTPException(status_code=404, detail="Table not found")
+
+        updated_table = {**previous, **update_data, "version": previous.get("version", 0) + 1}
+        status_history.record(previous, updated_table, now)
+        publish_table(updated_table)
+        return updated_table
 
     if (updated_table := await tables_collection.find_one({"_id": ObjectId(id)})) is not None:
         return updated_table
@@ -83,7 +356,48 @@ async def update_table(id: str, table_update: TableUpdate, current_user: User =
 
 @router.delete("/{id}")
 async def delete_table(id: str, current_user: User = Depends(get_current_user)):
-    delete_result = await tables_collection.delete_one({"_id": ObjectId(id)})
-    if delete_result.deleted_count == 1:
+    deleted_table = await tables_collection.find_one_and_delete({"_id": ObjectId(id)})
+    if deleted_table is not None:
+        publish_table_deleted(deleted_table)
+        presence.forget(deleted_table["tableId"])
+        await devices_collection.delete_one({"_id": deleted_table["tableId"]})
         return {"message": "Table deleted successfully"}
     raise HTTPException(status_code=404, detail="Table not found")
+
+@router.get("/analytics")
+async def get_analytics(
+    tableId: Optional[str] = None,
+    hour: Optional[int] = Query(default=None, ge=0, le=23),
+    current_user: User = Depends(get_current_user),
+):
+    """Time spent per status: overall, for one table, or for one hour of the day.
+
+    Reads the running aggregates kept by status_history, one document per status.
+    """
+    if tableId is not None and hour is not None:
+        raise HTTPException(status_code=400, detail="Filter by tableId or hour, not both")
+    if tableId is not None:
+        query = {"scope": "table", "tableId": tableId}
+    elif hour is not None:
+        query = {"scope": "hour", "hour": hour}
+    else:
+        query = {"scope": "all"}
+
+    stats = [summarize_stats(doc) async for doc in status_stats_collection.find(query)]
+    return {"tableId": tableId, "hour": hour, "states": stats}
+
+@router.post("/events/ticket")
+async def get_stream_ticket(token: str = Depends(oauth2_scheme), current_user: User = Depends(get_current_user)):
+    # EventSource cannot send an Authorization header, so it passes this ticket in the URL instead of the token
+    return {"ticket": create_stream_ticket(token), "expiresIn": STREAM_TICKET_SECONDS}
+
+@router.get("/events")
+async def stream_tables(ticket: str):
+    session = await redeem_stream_ticket(ticket)
+    subscription = status_hub.subscribe(ALL_TABLES)
+    return StreamingResponse(
+        # Ends the stream once the login session expires or is revoked
+        event_stream(subscription, lambda event: event, still_authorized=session.active),
+        media_type="text/event-stream",
+        headers=SSE_HEADERS,
+    )
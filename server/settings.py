@@ -0,0 +1,89 @@
+"""Configuration, read from the environment (and .env) once at startup."""
+import os
+import tempfile
+from dotenv import load_dotenv
+
+load_dotenv()
+
+
+def _bool(name: str, default: bool) -> bool:
+    return os.getenv(name, str(default)).lower() == "true"
+
+
+# MongoDB connection pool
+MONGO_URI = os.getenv("MONGO_URI")
+MONGO_MAX_POOL_SIZE = int(os.getenv("MONGO_MAX_POOL_SIZE", 100))
+# Opened during startup so the first requests after a deploy don't pay for them
+MONGO_MIN_POOL_SIZE = int(os.getenv("MONGO_MIN_POOL_SIZE", 10))
+MONGO_MAX_IDLE_TIME_MS = int(os.getenv("MONGO_MAX_IDLE_TIME_MS", 300000))
+MONGO_CONNECT_TIMEOUT_MS = int(os.getenv("MONGO_CONNECT_TIMEOUT_MS", 5000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.getenv("MONGO_SERVER_SELECTION_TIMEOUT_MS", 5000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.getenv("MONGO_SOCKET_TIMEOUT_MS", 10000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.getenv("MONGO_WAIT_QUEUE_TIMEOUT_MS", 2000))
+READINESS_TIMEOUT_SECONDS = float(os.getenv("READINESS_TIMEOUT_SECONDS", 2))
+# Deadline for a table write, retries included; MongoDB abandons it after that
+TABLE_WRITE_TIMEOUT_SECONDS = float(os.getenv("TABLE_WRITE_TIMEOUT_SECONDS", 3))
+# How far GET /api/tables?since= cursors trail the clock. updatedAt is stamped
+# just before the write, which commits within its deadline or not at all; the
+# extra second covers clock differences between app hosts.
+SYNC_CURSOR_LAG_SECONDS = float(os.getenv("SYNC_CURSOR_LAG_SECONDS", TABLE_WRITE_TIMEOUT_SECONDS + 1))
+
+# Auth
+SECRET_KEY = os.getenv("JWT_SECRET")
+ALGORITHM = os.getenv("ALGORITHM", "HS256")
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", 30))
+ADMIN_USERNAME = os.getenv("ADMIN_USERNAME", "admin")
+ADMIN_PASSWORD = os.getenv("ADMIN_PASSWORD")
+TOKEN_CACHE_SIZE = int(os.getenv("TOKEN_CACHE_SIZE", 1024))
+# How long a verified token is trusted before checking revocations again
+TOKEN_CACHE_SECONDS = float(os.getenv("TOKEN_CACHE_SECONDS", 60))
+# Lifetime of the single-use tickets that open the dashboard event stream
+STREAM_TICKET_SECONDS = int(os.getenv("STREAM_TICKET_SECONDS", 30))
+
+# CORS
+CORS_ORIGINS = [origin for origin in os.getenv("CORS_ORIGINS", "").split(",") if origin]
+CLIENT_PORT = os.getenv("CLIENT_PORT")
+
+# Table status caches
+STATUS_CACHE_SIZE = int(os.getenv("STATUS_CACHE_SIZE", 10000))
+_default_dir = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+SHARED_STATUS_PATH = os.getenv("SHARED_STATUS_PATH", os.path.join(_default_dir, "dinning_status.bin"))
+SHARED_STATUS_SLOTS = int(os.getenv("SHARED_STATUS_SLOTS", 4096))
+SHARED_STATUS_ENABLED = _bool("SHARED_STATUS_ENABLED", True)
+
+# Streams and background flushes
+STREAM_HEARTBEAT_SECONDS = float(os.getenv("STREAM_HEARTBEAT_SECONDS", 15))
+STATUS_HISTORY_FLUSH_SECONDS = float(os.getenv("STATUS_HISTORY_FLUSH_SECONDS", 5))
+STATUS_EVENT_RETENTION_DAYS = int(os.getenv("STATUS_EVENT_RETENTION_DAYS", 30))
+PRESENCE_FLUSH_SECONDS = float(os.getenv("PRESENCE_FLUSH_SECONDS", 5))
+DEVICE_ONLINE_SECONDS = int(os.getenv("DEVICE_ONLINE_SECONDS", 30))
+DEVICE_OFFLINE_SECONDS = int(os.getenv("DEVICE_OFFLINE_SECONDS", 300))
+EVENT_LOOP_LAG_INTERVAL = float(os.getenv("EVENT_LOOP_LAG_INTERVAL", 0.5))
+# /metrics is unauthenticated and a tableId is all a device needs to poll, so
+# per-table poll counts are only exported when asked for
+METRICS_TABLE_LABELS = _bool("METRICS_TABLE_LABELS", False)
+
+# Device poll interval hints
+POLL_MIN_MS = int(os.getenv("POLL_MIN_MS", 1000))
+POLL_MAX_MS = int(os.getenv("POLL_MAX_MS", 60000))
+POLL_INACTIVE_MS = int(os.getenv("POLL_INACTIVE_MS", 60000))
+POLL_JITTER = float(os.getenv("POLL_JITTER", 0.2))
+# A table that changed this recently is likely to change again soon
+POLL_RECENT_CHANGE_SECONDS = float(os.getenv("POLL_RECENT_CHANGE_SECONDS", 120))
+# Event loop lag at which the hint doubles
+POLL_LOAD_LAG_SECONDS = float(os.getenv("POLL_LOAD_LAG_SECONDS", 0.05))
+POLL_MAX_BACKOFF = float(os.getenv("POLL_MAX_BACKOFF", 4))
+
+# Binary status protocol for devices (UDP and TCP on the same port)
+STATUS_PROTOCOL_ENABLED = _bool("STATUS_PROTOCOL_ENABLED", False)
+STATUS_PROTOCOL_HOST = os.getenv("STATUS_PROTOCOL_HOST", "0.0.0.0")
+STATUS_PROTOCOL_PORT = int(os.getenv("STATUS_PROTOCOL_PORT", 1313))
+# JSON object of tableId -> shared secret; those tables must sign their queries
+STATUS_PROTOCOL_KEYS_FILE = os.getenv("STATUS_PROTOCOL_KEYS_FILE")
+# Reject unsigned queries even for tables without a key
+STATUS_PROTOCOL_REQUIRE_HMAC = _bool("STATUS_PROTOCOL_REQUIRE_HMAC", False)
+STATUS_PROTOCOL_TCP_IDLE_SECONDS = float(os.getenv("STATUS_PROTOCOL_TCP_IDLE_SECONDS", 120))
+# UDP queries that need a MongoDB lookup, answered concurrently; more are dropped
+STATUS_PROTOCOL_MAX_PENDING = int(os.getenv("STATUS_PROTOCOL_MAX_PENDING", 64))
+# How long an unknown tableId is answered "not found" without asking MongoDB again
+STATUS_PROTOCOL_NOT_FOUND_SECONDS = float(os.getenv("STATUS_PROTOCOL_NOT_FOUND_SECONDS", 10))
@@ -0,0 +1,274 @@
+import asyncio
+import glob
+import json
+import logging
+import mmap
+import os
+import socket
+import struct
+import zlib
+from typing import Callable, Optional
+from status_cache import TableStatus
+from settings import SHARED_STATUS_PATH, SHARED_STATUS_SLOTS, SHARED_STATUS_ENABLED
+
+try:
+    import fcntl
+except ImportError:  # Windows: no flock, fall back to per-process caches
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+STATUS_CODES = {"idle": 0, "placed": 1, "processing": 2, "delivered": 3}
+STATUS_NAMES = {code: name for name, code in STATUS_CODES.items()}
+
+MAGIC = b"DSST"
+HEADER = struct.Struct("<4sI")  # magic, slot count
+# seqlock, tableId, status code, isActive, padding, version
+SLOT = struct.Struct("<I16sBB2xQ")
+SEQ = struct.Struct("<I")
+KEY_SIZE = 16
+MAX_PROBES = 64
+# A write takes well under a microsecond; a slot still changing after this
+# many tries has a writer that was descheduled or died, so stop spinning the
+# event loop and treat the lookup as a miss
+MAX_READ_RETRIES = 100
+TOMBSTONE = 0xFF
+
+
+class SharedStatusTable:
+    """Fixed-slot tableId -> (status code, isActive, version) table in a shared mmap.
+
+    Every uvicorn worker on the host maps the same file. Writers serialize on
+    flock and publish each slot under a seqlock; readers never lock, they
+    retry if a slot changed while they copied it. Deleted tables leave a
+    tombstone so probe chains stay intact.
+
+    The file is mapped by open() during app startup; until then (and after
+    close) lookups miss and writes are refused. It outlives the server (it
+    sits in /dev/shm), so the first worker of each start clears it: every
+    open worker holds a shared lock on a companion .live file, and a worker
+    that can lock it exclusively knows no other worker is running.
+    """
+
+    def __init__(self, path: str = SHARED_STATUS_PATH, slots: int = SHARED_STATUS_SLOTS):
+        self.path = path
+        self.slots = slots
+        self._fd = None
+        self._live_fd = None
+        self._mm = None
+
+    def open(self):
+        if self._mm is not None:
+            return
+        size = HEADER.size + SLOT.size * self.slots
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        self._live_fd = os.open(self.path + ".live", os.O_RDWR | os.O_CREAT, 0o600)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            try:
+                fcntl.flock(self._live_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                first_worker = True
+            except BlockingIOError:
+                first_worker = False
+            # Held until this worker exits, however it exits
+            fcntl.flock(self._live_fd, fcntl.LOCK_SH)
+            existing = os.fstat(self._fd).st_size
+            header = os.pread(self._fd, HEADER.size, 0) if existing >= HEADER.size else b""
+            # Entries left by a previous start may be for tables deleted or
+            # edited since, and a running worker may have laid out another size
+            if first_worker or len(header) != HEADER.size or HEADER.unpack(header) != (MAGIC, self.slots):
+                os.ftruncate(self._fd, 0)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, self.slots), 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._mm = mmap.mmap(self._fd, size)
+
+    def _offset(self, index: int) -> int:
+        return HEADER.size + index * SLOT.size
+
+    def _read_slot(self, offset: int, locked: bool = False):
+        """A consistent copy of the slot, or None if it kept changing."""
+        if locked:
+            # Holding the writer lock: nothing can change underneath
+            return SLOT.unpack_from(self._mm, offset)
+        for _ in range(MAX_READ_RETRIES):
+            before = SEQ.unpack_from(self._mm, offset)[0]
+            if before & 1:
+                continue  # Writer in progress
+            slot = SLOT.unpack_from(self._mm, offset)
+            # The sequence must be read again after the copy; slot[0] was read before the rest
+            if SEQ.unpack_from(self._mm, offset)[0] == before:
+                return slot
+        # The next write under flock repairs a slot whose writer died mid-update
+        return None
+
+    def _find(self, key: bytes, locked: bool = False):
+        """(offset, slot) of key's slot, or (first reusable offset or None if full, None).
+
+        Without the writer lock a slot that can't be read consistently ends the
+        search as a miss, so the caller falls back to its own cache or Mongo.
+        """
+        start = zlib.crc32(key) % self.slots
+        reusable = None
+        for probe in range(min(MAX_PROBES, self.slots)):
+            offset = self._offset((start + probe) % self.slots)
+            slot = self._read_slot(offset, locked)
+            if slot is None:
+                return None, None
+            _, slot_key, code, _, _ = slot
+            if slot_key == key:
+                return offset, slot
+            if code == TOMBSTONE and reusable is None:
+                reusable = offset
+            if slot_key == b"\0" * KEY_SIZE:
+                return (reusable if reusable is not None else offset), None
+        return reusable, None
+
+    @staticmethod
+    def _key(table_id: str) -> Optional[bytes]:
+        key = table_id.encode()
+        if len(key) > KEY_SIZE:
+            return None
+        return key.ljust(KEY_SIZE, b"\0")
+
+    def get(self, table_id: str) -> Optional[TableStatus]:
+        key = self._key(table_id)
+        if key is None or self._mm is None:
+            return None
+        # Use the copy _find matched on; reading the slot again could see another key
+        _, slot = self._find(key)
+        if slot is None:
+            return None
+        _, _, code, active, version = slot
+        if code not in STATUS_NAMES:
+            return None
+        return TableStatus(status=STATUS_NAMES[code], version=version, isActive=bool(active))
+
+    def _write(self, offset: int, key: bytes, code: int, active: bool, version: int):
+        seq = SEQ.unpack_from(self._mm, offset)[0] & ~1
+        SEQ.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+        SLOT.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF, key, code, int(active), version)
+        SEQ.pack_into(self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def set(self, table_id: str, entry: TableStatus) -> bool:
+        """Store entry unless a newer version is already there. Returns False if
+        the table cannot be kept here (long id, custom status, table full)."""
+        key = self._key(table_id)
+        if key is None or self._mm is None:
+            return False
+        code = STATUS_CODES.get(entry.status)
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, slot = self._find(key, locked=True)
+            if code is None:
+                # Unknown status: make sure readers don't see an older one
+                if slot is not None:
+                    self._write(offset, key, TOMBSTONE, False, 0)
+                return False
+            if offset is None:
+                return False
+            if slot is not None:
+                _, _, current_code, _, current_version = slot
+                if current_code != TOMBSTONE and current_version > entry.version:
+                    return True
+            self._write(offset, key, code, entry.isActive, entry.version)
+            return True
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def delete(self, table_id: str):
+        key = self._key(table_id)
+        if key is None or self._mm is None:
+            return
+        fcntl.flock(self._fd, fcntl.LOCK_EX)
+        try:
+            offset, slot = self._find(key, locked=True)
+            if slot is not None:
+                self._write(offset, key, TOMBSTONE, False, 0)
+        finally:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+
+    def close(self):
+        if self._mm is None:
+            return
+        self._mm.close()
+        os.close(self._fd)
+        os.close(self._live_fd)
+        self._mm = None
+        self._fd = None
+        self._live_fd = None
+
+
+class _BroadcastProtocol(asyncio.DatagramProtocol):
+    def __init__(self, on_event: Callable[[dict], None]):
+        self.on_event = on_event
+
+    def datagram_received(self, data, addr):
+        try:
+            self.on_event(json.loads(data))
+        except Exception:
+            logger.exception("Bad status broadcast")
+
+
+class StatusBroadcast:
+    """Tells the other workers on this host about table changes.
+
+    Each worker binds a unix datagram socket in a shared directory; a write
+    sends the event to every other socket there so those workers can refresh
+    their local cache and push to their own stream subscribers.
+    """
+
+    def __init__(self, directory: str = SHARED_STATUS_PATH + ".d"):
+        self.directory = directory
+        self.path = None
+        self._sock = None
+        self._transport = None
+
+    async def start(self, on_event: Callable[[dict], None]):
+        os.makedirs(self.directory, mode=0o700, exist_ok=True)
+        # Resolved here, not at import, so forked workers get their own socket
+        self.path = os.path.join(self.directory, f"{os.getpid()}.sock")
+        if os.path.exists(self.path):
+            os.unlink(self.path)
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+        self._sock.bind(self.path)
+        self._sock.setblocking(False)
+        loop = asyncio.get_running_loop()
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _BroadcastProtocol(on_event), sock=self._sock
+        )
+
+    def send(self, event: dict):
+        if self._sock is None:
+            return
+        data = json.dumps(event).encode()
+        for peer in glob.glob(os.path.join(self.directory, "*.sock")):
+            if peer == self.path:
+                continue
+            try:
+                self._sock.sendto(data, peer)
+            except (ConnectionRefusedError, FileNotFoundError):
+                # Worker is gone; clean up after it
+                try:
+                    os.unlink(peer)
+                except FileNotFoundError:
+                    pass
+            except BlockingIOError:
+                logger.warning("Status broadcast to %s dropped, peer is not reading", peer)
+
+    def close(self):
+        if self._transport is not None:
+            self._transport.close()
+        self._sock = None
+        if self.path is None:
+            return
+        try:
+            os.unlink(self.path)
+        except FileNotFoundError:
+            pass
+
+
+# Windows has no flock, so it falls back to per-process caches
+shared_status = SharedStatusTable() if SHARED_STATUS_ENABLED and fcntl is not None else None
+status_broadcast = StatusBroadcast() if SHARED_STATUS_ENABLED and fcntl is not None else None
@@ -0,0 +1,63 @@
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+from settings import STATUS_CACHE_SIZE
+
+
+class TableStatus(NamedTuple):
+    status: str
+    version: int
+    isActive: bool = True
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.version}"'
+
+
+class StatusCache:
+    """Bounded LRU map of tableId -> TableStatus.
+
+    The write paths in routes/tables.py keep it up to date, so the IoT poll
+    only falls back to Mongo for tables it has not seen yet.
+    """
+
+    def __init__(self, max_size: int = STATUS_CACHE_SIZE):
+        self.max_size = max_size
+        self._entries: "OrderedDict[str, TableStatus]" = OrderedDict()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, table_id: str) -> Optional[TableStatus]:
+        entry = self._entries.get(table_id)
+        if entry is not None:
+            self._entries.move_to_end(table_id)
+        return entry
+
+    def set(self, table_id: str, entry: TableStatus) -> TableStatus:
+        current = self._entries.get(table_id)
+        # Never let a slow read overwrite a newer version written meanwhile
+        if current is not None and current.version > entry.version:
+            self._entries.move_to_end(table_id)
+            return current
+        self._entries[table_id] = entry
+        self._entries.move_to_end(table_id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+        return entry
+
+    def set_from_document(self, table: dict) -> TableStatus:
+        entry = TableStatus(
+            status=table["status"],
+            version=table.get("version", 0),
+            isActive=table.get("isActive", True),
+        )
+        return self.set(table["tableId"], entry)
+
+    def invalidate(self, table_id: str):
+        self._entries.pop(table_id, None)
+
+    def clear(self):
+        self._entries.clear()
+
+
+status_cache = StatusCache()
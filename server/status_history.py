@@ -0,0 +1,164 @@
+import asyncio
+import logging
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from typing import List, Optional
+from pymongo import UpdateOne
+from database import status_events_collection, status_stats_collection
+from settings import STATUS_HISTORY_FLUSH_SECONDS, STATUS_EVENT_RETENTION_DAYS
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the duration histogram used for percentiles
+DURATION_BUCKETS = (15, 30, 60, 120, 300, 600, 900, 1200, 1800, 2700, 3600, 7200, 14400)
+
+
+def duration_bucket(seconds: float) -> int:
+    return bisect_left(DURATION_BUCKETS, seconds)
+
+
+def stats_key(scope: str, state: str, tableId: Optional[str] = None, hour: Optional[int] = None) -> str:
+    if scope == "table":
+        return f"table:{tableId}:{state}"
+    if scope == "hour":
+        return f"hour:{hour}:{state}"
+    return f"all:{state}"
+
+
+class StatusHistory:
+    """Records status transitions and flushes them in batches.
+
+    Each transition closes the time spent in the previous status. A background
+    task writes the raw events into hourly per-table buckets (expired by a TTL
+    index) and $inc's running totals and histogram counts in status_stats, so
+    analytics never scan the events.
+    """
+
+    def __init__(self):
+        self._pending: List[dict] = []
+        # (collection, operations) batches that still have to be written
+        self._unwritten: List[tuple] = []
+
+    def record(self, before: dict, after: dict, at: datetime):
+        """before must be the document as it was just before the write that
+        changed the status; that write sets statusSince in the same $set."""
+        if before.get("status") == after.get("status"):
+            return
+        since = before.get("statusSince")
+        if since is None:
+            # Written before statusSince existed: when this status began is
+            # unknown, and guessing would skew the averages for good. The write
+            # sets statusSince, so the table's next transition is recorded.
+            return
+        self._pending.append({
+            "tableId": before["tableId"],
+            "from": before.get("status"),
+            "to": after.get("status"),
+            "at": at,
+            "since": since,
+            "duration": max(0.0, (at - since).total_seconds()),
+        })
+
+    def _operations(self, events: List[dict]):
+        buckets = {}
+        stats = {}
+        for event in events:
+            hour = event["at"].replace(minute=0, second=0, microsecond=0)
+            bucket_id = f"{event['tableId']}:{hour:%Y%m%d%H}"
+            bucket = buckets.setdefault(bucket_id, {"tableId": event["tableId"], "hour": hour, "events": []})
+            bucket["events"].append({k: event[k] for k in ("from", "to", "at", "duration")})
+
+            state = event["from"]
+            bucket_index = duration_bucket(event["duration"])
+            entered_hour = event["since"].hour
+            for key, fields in (
+                (stats_key("all", state), {"scope": "all"}),
+                (stats_key("table", state, tableId=event["tableId"]), {"scope": "table", "tableId": event["tableId"]}),
+                (stats_key("hour", state, hour=entered_hour), {"scope": "hour", "hour": entered_hour}),
+            ):
+                entry = stats.setdefault(key, {"fields": {**fields, "state": state}, "inc": {}})
+                inc = entry["inc"]
+                inc["count"] = inc.get("count", 0) + 1
+                inc["total"] = inc.get("total", 0.0) + event["duration"]
+                inc[f"buckets.{bucket_index}"] = inc.get(f"buckets.{bucket_index}", 0) + 1
+
+        event_ops = [
+            UpdateOne(
+                {"_id": bucket_id},
+                {
+                    "$push": {"events": {"$each": bucket["events"]}},
+                    "$inc": {"count": len(bucket["events"])},
+                    "$setOnInsert": {
+                        "tableId": bucket["tableId"],
+                        "hour": bucket["hour"],
+                        "expiresAt": bucket["hour"] + timedelta(days=STATUS_EVENT_RETENTION_DAYS),
+                    },
+                },
+                upsert=True,
+            )
+            for bucket_id, bucket in buckets.items()
+        ]
+        stats_ops = [
+            UpdateOne(
+                {"_id": key},
+                {
+                    "$inc": entry["inc"],
+                    "$setOnInsert": entry["fields"],
+                },
+                upsert=True,
+            )
+            for key, entry in stats.items()
+        ]
+        return event_ops, stats_ops
+
+    async def flush(self):
+        if self._pending:
+            events, self._pending = self._pending, []
+            event_ops, stats_ops = self._operations(events)
+            self._unwritten += [(status_events_collection, event_ops), (status_stats_collection, stats_ops)]
+        # A failed batch stays queued for the next flush rather than being dropped.
+        # If it failed part-way, retrying can count some events twice; that is
+        # preferred over losing them.
+        while self._unwritten:
+            collection, operations = self._unwritten[0]
+            await collection.bulk_write(operations, ordered=False)
+            self._unwritten.pop(0)
+
+    async def run(self):
+        try:
+            while True:
+                await asyncio.sleep(STATUS_HISTORY_FLUSH_SECONDS)
+                try:
+                    await self.flush()
+                except Exception:
+                    logger.exception("Status history flush failed")
+        finally:
+            await self.flush()
+
+
+def summarize_stats(doc: dict) -> dict:
+    count = doc.get("count", 0)
+    # $inc on "buckets.<i>" stores the histogram as an object keyed by index
+    buckets = [doc.get("buckets", {}).get(str(i), 0) for i in range(len(DURATION_BUCKETS) + 1)]
+
+    def percentile(pct):
+        # Upper bound of the histogram bucket holding the percentile
+        target = pct / 100 * count
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= target and bucket_count:
+                return DURATION_BUCKETS[index] if index < len(DURATION_BUCKETS) else None
+        return None
+
+    return {
+        "state": doc["state"],
+        "count": count,
+        "averageSeconds": round(doc.get("total", 0) / count, 1) if count else None,
+        "p50Seconds": percentile(50),
+        "p90Seconds": percentile(90),
+        "p95Seconds": percentile(95),
+    }
+
+
+status_history = StatusHistory()
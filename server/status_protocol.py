@@ -0,0 +1,279 @@
+"""Binary status protocol for devices that can't afford HTTP and JSON.
+
+Query (big-endian):
+    u8  protocol version (1)
+    u8  flags (bit 0: HMAC appended)
+    u32 request id, echoed in the reply
+    u32 last version the device saw, 0xFFFFFFFF for none
+    u8  tableId length, then the tableId bytes
+    [8 bytes HMAC-SHA256 of everything before it, truncated]
+
+Reply:
+    u8  protocol version
+    u8  result (see RESULT_*)
+    u32 request id
+    u8  status code (shared_status.STATUS_CODES, 0xFF for anything else)
+    u8  flags (bit 0: table is active)
+    u32 version
+    u16 next poll hint in units of 100 ms
+    [8 bytes HMAC, when the query was signed]
+
+Over UDP each datagram is one frame. Over TCP each frame is preceded by a u8
+length and a connection may send any number of queries.
+"""
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import socket
+import struct
+import time
+from collections import OrderedDict
+from typing import Dict, NamedTuple, Optional
+from shared_status import STATUS_CODES
+from status_cache import TableStatus
+from routes.iot import cached_table_status, lookup_table_status, record_device_poll
+from settings import (
+    STATUS_PROTOCOL_HOST, STATUS_PROTOCOL_PORT, STATUS_PROTOCOL_KEYS_FILE,
+    STATUS_PROTOCOL_REQUIRE_HMAC, STATUS_PROTOCOL_TCP_IDLE_SECONDS, STATUS_PROTOCOL_MAX_PENDING,
+    STATUS_PROTOCOL_NOT_FOUND_SECONDS,
+)
+import metrics
+
+logger = logging.getLogger(__name__)
+
+PROTOCOL_VERSION = 1
+QUERY = struct.Struct("!BBIIB")
+REPLY = struct.Struct("!BBIBBIH")
+LENGTH = struct.Struct("!B")
+MAC_SIZE = 8
+FLAG_HMAC = 0x01
+FLAG_ACTIVE = 0x01
+NO_VERSION = 0xFFFFFFFF
+UNKNOWN_STATUS = 0xFF
+NOT_FOUND_CACHE_SIZE = 4096
+
+RESULT_OK = 0
+RESULT_NOT_MODIFIED = 1
+RESULT_NOT_FOUND = 2
+RESULT_UNAUTHORIZED = 3
+
+
+class Query(NamedTuple):
+    request_id: int
+    version: Optional[int]
+    table_id: str
+    signed_part: bytes
+    mac: Optional[bytes]
+
+
+def parse_query(frame: bytes) -> Query:
+    """Raises ValueError for anything that isn't a well-formed query."""
+    if len(frame) < QUERY.size:
+        raise ValueError("Short query")
+    protocol, flags, request_id, version, id_length = QUERY.unpack_from(frame)
+    if protocol != PROTOCOL_VERSION:
+        raise ValueError(f"Unsupported protocol version {protocol}")
+    end = QUERY.size + id_length
+    signed = bool(flags & FLAG_HMAC)
+    if len(frame) != end + (MAC_SIZE if signed else 0):
+        raise ValueError("Bad query length")
+    return Query(
+        request_id=request_id,
+        version=None if version == NO_VERSION else version,
+        table_id=frame[QUERY.size:end].decode(),
+        signed_part=frame[:end],
+        mac=frame[end:] if signed else None,
+    )
+
+
+def sign(key: bytes, data: bytes) -> bytes:
+    return hmac.new(key, data, hashlib.sha256).digest()[:MAC_SIZE]
+
+
+def encode_reply(request_id: int, result: int, table: Optional[TableStatus] = None,
+                 next_poll_ms: int = 0, key: Optional[bytes] = None) -> bytes:
+    if table is None:
+        status_code, flags, version = UNKNOWN_STATUS, 0, 0
+    else:
+        status_code = STATUS_CODES.get(table.status, UNKNOWN_STATUS)
+        flags = FLAG_ACTIVE if table.isActive else 0
+        version = table.version & 0xFFFFFFFF
+    reply = REPLY.pack(PROTOCOL_VERSION, result, request_id, status_code, flags, version,
+                       min(0xFFFF, next_poll_ms // 100))
+    return reply + sign(key, reply) if key is not None else reply
+
+
+def load_keys(path: Optional[str]) -> Dict[str, bytes]:
+    if not path:
+        return {}
+    with open(path) as keys_file:
+        return {table_id: secret.encode() for table_id, secret in json.load(keys_file).items()}
+
+
+class StatusProtocolServer:
+    """Answers binary status queries over UDP and TCP.
+
+    Lookups go through the same cache and poll bookkeeping as
+    POST /api/iot/table-status. A UDP query for a cached table is answered
+    inside datagram_received, without creating a task. UDP source addresses
+    can be spoofed, so the lookups that do need MongoDB are capped at
+    STATUS_PROTOCOL_MAX_PENDING and unknown tableIds are remembered for a
+    while. The port is bound with SO_REUSEPORT where available so every
+    uvicorn worker can listen on it.
+    """
+
+    def __init__(self, host: str = STATUS_PROTOCOL_HOST, port: int = STATUS_PROTOCOL_PORT):
+        self.host = host
+        self.port = port
+        self.keys: Dict[str, bytes] = {}
+        self._transport = None
+        self._server = None
+        self._connections = set()
+        self._tasks = set()
+        self._not_found: "OrderedDict[str, float]" = OrderedDict()
+
+    async def start(self):
+        self.keys = load_keys(STATUS_PROTOCOL_KEYS_FILE)
+        loop = asyncio.get_running_loop()
+        reuse_port = hasattr(socket, "SO_REUSEPORT")
+        self._transport, _ = await loop.create_datagram_endpoint(
+            lambda: _StatusDatagramProtocol(self),
+            local_addr=(self.host, self.port),
+            reuse_port=reuse_port or None,
+        )
+        self._server = await asyncio.start_server(
+            self._serve_connection, self.host, self.port, reuse_port=reuse_port or None
+        )
+
+    def _check(self, query: Query):
+        """Returns (key to sign the reply with, or None; whether to refuse)."""
+        key = self.keys.get(query.table_id)
+        if key is None:
+            return None, STATUS_PROTOCOL_REQUIRE_HMAC
+        if query.mac is None or not hmac.compare_digest(query.mac, sign(key, query.signed_part)):
+            return None, True
+        return key, False
+
+    def _known_missing(self, table_id: str) -> bool:
+        expires = self._not_found.get(table_id)
+        if expires is None:
+            return False
+        if expires > time.monotonic():
+            return True
+        del self._not_found[table_id]
+        return False
+
+    def _remember_missing(self, table_id: str):
+        self._not_found[table_id] = time.monotonic() + STATUS_PROTOCOL_NOT_FOUND_SECONDS
+        self._not_found.move_to_end(table_id)
+        if len(self._not_found) > NOT_FOUND_CACHE_SIZE:
+            self._not_found.popitem(last=False)
+
+    def _answer(self, query: Query, table: Optional[TableStatus], ip: Optional[str], key: Optional[bytes]) -> bytes:
+        if table is None:
+            return encode_reply(query.request_id, RESULT_NOT_FOUND, key=key)
+        next_poll_ms = record_device_poll(query.table_id, table, ip)
+        result = RESULT_NOT_MODIFIED if query.version == table.version & 0xFFFFFFFF else RESULT_OK
+        return encode_reply(query.request_id, result, table, next_poll_ms, key)
+
+    def answer_cached(self, query: Query, ip: Optional[str]) -> Optional[bytes]:
+        """Reply without awaiting anything, or None if the table needs a Mongo lookup."""
+        key, refused = self._check(query)
+        if refused:
+            return encode_reply(query.request_id, RESULT_UNAUTHORIZED)
+        table = cached_table_status(query.table_id)
+        if table is None and not self._known_missing(query.table_id):
+            return None
+        return self._answer(query, table, ip, key)
+
+    async def answer(self, query: Query, ip: Optional[str]) -> bytes:
+        key, refused = self._check(query)
+        if refused:
+            return encode_reply(query.request_id, RESULT_UNAUTHORIZED)
+        table = cached_table_status(query.table_id)
+        if table is None and not self._known_missing(query.table_id):
+            table = await lookup_table_status(query.table_id)
+            if table is None:
+                self._remember_missing(query.table_id)
+        return self._answer(query, table, ip, key)
+
+    def datagram_received(self, data: bytes, addr):
+        started = time.perf_counter()
+        try:
+            query = parse_query(data)
+        except ValueError:
+            return  # Not for us; don't answer garbage
+        reply = self.answer_cached(query, addr[0])
+        if reply is not None:
+            self._transport.sendto(reply, addr)
+            observe("UDP", reply, started)
+            return
+        if len(self._tasks) >= STATUS_PROTOCOL_MAX_PENDING:
+            # The device asks again on its next poll
+            metrics.status_queries_dropped += 1
+            return
+        task = asyncio.create_task(self._answer_datagram(query, addr, started))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _answer_datagram(self, query: Query, addr, started: float):
+        try:
+            reply = await self.answer(query, addr[0])
+        except Exception:
+            logger.exception("Status query for %s failed", query.table_id)
+            return
+        if self._transport is not None:
+            self._transport.sendto(reply, addr)
+            observe("UDP", reply, started)
+
+    async def _serve_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._connections.add(writer)
+        peer = writer.get_extra_info("peername")
+        ip = peer[0] if peer else None
+        try:
+            while True:
+                length = LENGTH.unpack(await asyncio.wait_for(
+                    reader.readexactly(LENGTH.size), STATUS_PROTOCOL_TCP_IDLE_SECONDS
+                ))[0]
+                frame = await asyncio.wait_for(reader.readexactly(length), STATUS_PROTOCOL_TCP_IDLE_SECONDS)
+                started = time.perf_counter()
+                reply = await self.answer(parse_query(frame), ip)
+                writer.write(LENGTH.pack(len(reply)) + reply)
+                await writer.drain()
+                observe("TCP", reply, started)
+        except (asyncio.IncompleteReadError, asyncio.TimeoutError, ConnectionError, ValueError):
+            pass  # Client left, went quiet or sent garbage
+        finally:
+            self._connections.discard(writer)
+            writer.close()
+
+    async def close(self):
+        if self._transport is not None:
+            self._transport.close()
+            self._transport = None
+        for task in list(self._tasks):
+            task.cancel()
+        if self._server is not None:
+            self._server.close()
+            for writer in list(self._connections):
+                writer.close()
+            await self._server.wait_closed()
+            self._server = None
+
+
+class _StatusDatagramProtocol(asyncio.DatagramProtocol):
+    def __init__(self, server: StatusProtocolServer):
+        self.server = server
+
+    def datagram_received(self, data, addr):
+        self.server.datagram_received(data, addr)
+
+
+def observe(transport: str, reply: bytes, started: float):
+    # Shows up next to the HTTP routes in /metrics, labelled by result code
+    metrics.request_latency.observe((transport, "status-protocol", reply[1]), time.perf_counter() - started)
+
+
+status_protocol = StatusProtocolServer()
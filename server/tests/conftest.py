@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# The server uses flat imports (from database import ...), as when run from server/
+sys.path.insert(0, os.path.join(ROOT, "server"))
+sys.path.insert(0, os.path.join(ROOT, "bench"))
+os.environ.setdefault("JWT_SECRET", "test-secret")
+os.environ.setdefault("ADMIN_PASSWORD", "test-password")
+os.environ["SHARED_STATUS_ENABLED"] = "false"
+os.environ["STATUS_PROTOCOL_ENABLED"] = "false"
+
+import memory_mongo  # noqa: E402
+
+# Before anything imports the routes, so no test can reach a real MongoDB
+memory_mongo.install()
+
+
+@pytest.fixture
+def db():
+    """A fresh in-memory database behind the server's collections."""
+    from status_cache import status_cache
+
+    status_cache.clear()
+    return memory_mongo.install()
+
+
+@pytest.fixture
+def client(db, monkeypatch):
+    from fastapi.testclient import TestClient
+    import auth
+    from main import app
+
+    # Tokens issued within the same second are identical, so start without
+    # the revocations of earlier tests
+    monkeypatch.setattr(auth, "token_cache", auth.TokenCache())
+    with TestClient(app) as client:
+        login = {"username": "admin", "password": os.environ["ADMIN_PASSWORD"]}
+        token = client.post("/api/auth/login", json=login).json()["access_token"]
+        client.headers["Authorization"] = f"Bearer {token}"
+        yield client
@@ -0,0 +1,68 @@
+import time
+
+import pytest
+
+import auth
+from auth import TokenCache, admin_user, apply_revocation
+
+
+@pytest.fixture
+def cache():
+    return TokenCache(max_size=3)
+
+
+def test_cached_tokens_expire_with_the_token(cache):
+    cache.set("fresh", time.time() + 60, admin_user)
+    cache.set("expired", time.time() - 1, admin_user)
+    assert cache.get("fresh") == admin_user
+    assert cache.get("expired") is None
+    assert cache.get("unknown") is None
+
+
+def test_cached_tokens_are_rechecked_after_token_cache_seconds(cache, monkeypatch):
+    monkeypatch.setattr(auth, "TOKEN_CACHE_SECONDS", 0)
+    cache.set("token", time.time() + 3600, admin_user)
+    assert cache.get("token") is None
+
+
+def test_cache_keeps_the_most_recently_used_tokens(cache):
+    for token in ("a", "b", "c"):
+        cache.set(token, time.time() + 60, admin_user)
+    cache.get("a")
+    cache.set("d", time.time() + 60, admin_user)
+    assert [token for token in "abcd" if cache.get(token)] == ["a", "c", "d"]
+
+
+def test_revoking_drops_the_cached_token(cache):
+    cache.set("token", time.time() + 60, admin_user)
+    key = TokenCache.key("token")
+    cache.revoke(key, time.time() + 60)
+    assert cache.get("token") is None
+    assert cache.is_revoked(key)
+
+
+def test_revocations_are_forgotten_once_the_token_has_expired(cache):
+    cache.revoke(TokenCache.key("old"), time.time() - 1)
+    cache.revoke(TokenCache.key("new"), time.time() + 60)
+    assert not cache.is_revoked(TokenCache.key("old"))
+    assert cache.is_revoked(TokenCache.key("new"))
+
+
+def test_logout_revokes_the_token(client):
+    assert client.get("/api/tables/").status_code == 200
+    assert client.post("/api/auth/logout").status_code == 200
+    assert client.get("/api/tables/").status_code == 401
+
+
+def test_logout_reaches_workers_that_never_saw_it(client, monkeypatch):
+    client.post("/api/auth/logout")
+    # A worker on another host, or one started later: only MongoDB knows
+    monkeypatch.setattr(auth, "token_cache", TokenCache())
+    assert client.get("/api/tables/").status_code == 401
+
+
+def test_revocation_broadcast_by_another_worker(client):
+    assert client.get("/api/tables/").status_code == 200
+    token = client.headers["Authorization"].split()[1]
+    apply_revocation({"type": "token_revoked", "key": TokenCache.key(token), "exp": time.time() + 60})
+    assert client.get("/api/tables/").status_code == 401
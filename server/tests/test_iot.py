@@ -0,0 +1,45 @@
+import metrics
+import routes.iot as iot
+from presence import presence
+
+
+def create(client, name, status=None):
+    table = client.post("/api/tables/", json={"tableName": name}).json()
+    if status is not None:
+        table = client.put(f"/api/tables/{table['_id']}", json={"status": status}).json()
+    return table
+
+
+def test_batch_poll_returns_changes_and_missing_tables(client):
+    idle = create(client, "Patio")
+    busy = create(client, "Bar", "processing")
+    body = client.post("/api/iot/table-status/batch", json={
+        "tableIds": [idle["tableId"], busy["tableId"], "NOPE"],
+        "versions": {idle["tableId"]: idle["version"]},
+    }).json()
+    assert body["tables"] == {busy["tableId"]: {"status": "processing", "version": busy["version"]}}
+    assert body["missing"] == ["NOPE"]
+
+
+def test_batch_poll_is_bookkept_like_single_polls(client, monkeypatch):
+    idle = create(client, "Patio")
+    busy = create(client, "Bar", "processing")
+    hints = {}
+
+    def record_device_poll(table_id, table, ip, firmware=None):
+        hints[table_id] = 5000 if table_id == idle["tableId"] else 1500
+        return hints[table_id]
+
+    monkeypatch.setattr(iot, "record_device_poll", record_device_poll)
+    body = client.post("/api/iot/table-status/batch", json={"tableIds": [idle["tableId"], busy["tableId"]]}).json()
+    assert set(hints) == {idle["tableId"], busy["tableId"]}
+    # The busiest table sets the gateway's pace
+    assert body["nextPollMs"] == 1500
+
+
+def test_batch_poll_counts_polls_and_presence(client):
+    table = create(client, "Patio")
+    polls = metrics.polls
+    client.post("/api/iot/table-status/batch", json={"tableIds": [table["tableId"]], "firmware": "gw-2"})
+    assert metrics.polls == polls + 1
+    assert presence.local()[table["tableId"]]["firmware"] == "gw-2"
@@ -0,0 +1,23 @@
+import metrics
+
+
+def polled_table(client):
+    table = client.post("/api/tables/", json={"tableName": "Patio"}).json()
+    client.post("/api/iot/table-status", json={"tableId": table["tableId"]})
+    client.post("/api/iot/table-status/batch", json={"tableIds": [table["tableId"]]})
+    return table["tableId"]
+
+
+def test_table_ids_stay_out_of_metrics_by_default(client):
+    polls = metrics.polls
+    table_id = polled_table(client)
+    body = client.get("/metrics").text
+    assert table_id not in body
+    assert f"iot_polls_total {polls + 2}" in body
+
+
+def test_per_table_polls_when_enabled(client, monkeypatch):
+    monkeypatch.setattr(metrics, "METRICS_TABLE_LABELS", True)
+    monkeypatch.setattr(metrics, "table_polls", {})
+    table_id = polled_table(client)
+    assert f'iot_table_polls_total{{tableId="{table_id}"}} 2' in client.get("/metrics").text
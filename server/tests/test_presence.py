@@ -0,0 +1,50 @@
+import asyncio
+
+import pytest
+
+import presence as presence_module
+from presence import PresenceTracker
+
+
+class FailingCollection:
+    async def bulk_write(self, operations, ordered=True):
+        raise ConnectionError("MongoDB unavailable")
+
+
+@pytest.fixture
+def tracker(db):
+    return PresenceTracker()
+
+
+def stored(db, table_id):
+    return asyncio.run(db["devices"].find_one({"_id": table_id}))
+
+
+def test_flush_adds_poll_deltas(db, tracker):
+    tracker.seen("T1", "10.0.0.2", "1.4")
+    tracker.seen("T1")
+    asyncio.run(tracker.flush())
+    tracker.seen("T1")
+    asyncio.run(tracker.flush())
+
+    device = stored(db, "T1")
+    assert device["polls"] == 3
+    assert (device["ip"], device["firmware"]) == ("10.0.0.2", "1.4")
+    assert device["lastSeen"] == tracker.local()["T1"]["lastSeen"]
+
+
+def test_failed_flush_keeps_polls_for_the_next_one(db, tracker, monkeypatch):
+    tracker.seen("T1")
+    tracker.seen("T2")
+    with monkeypatch.context() as patch:
+        patch.setattr(presence_module, "devices_collection", FailingCollection())
+        with pytest.raises(ConnectionError):
+            asyncio.run(tracker.flush())
+
+    # Polls that arrive before the retry are added on top
+    tracker.seen("T1")
+    asyncio.run(tracker.flush())
+
+    assert stored(db, "T1")["polls"] == 2
+    assert stored(db, "T2")["polls"] == 1
+    assert stored(db, "T2")["lastSeen"] == tracker.local()["T2"]["lastSeen"]
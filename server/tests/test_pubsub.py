@@ -0,0 +1,70 @@
+import asyncio
+
+import pytest
+
+import pubsub
+from pubsub import StatusHub, event_stream
+
+HEARTBEAT = 0.2
+EVENT_INTERVAL = 0.05
+
+
+async def busy_stream(authorized, seconds):
+    """Publish faster than the heartbeat and read the stream for up to `seconds`."""
+    hub = pubsub.status_hub
+    checks = []
+
+    async def still_authorized():
+        checks.append(None)
+        return authorized
+
+    stream = event_stream(hub.subscribe(), lambda event: event, still_authorized=still_authorized)
+    chunks = []
+    loop = asyncio.get_running_loop()
+    end = loop.time() + seconds
+    n = 0
+    try:
+        while loop.time() < end:
+            hub.publish(f"T{n % 3}", {"n": n})
+            n += 1
+            try:
+                chunks.append(await stream.__anext__())
+            except StopAsyncIteration:
+                break
+            await asyncio.sleep(EVENT_INTERVAL)
+    finally:
+        await stream.aclose()
+    return chunks, checks, hub
+
+
+@pytest.fixture(autouse=True)
+def quick_heartbeat(monkeypatch):
+    monkeypatch.setattr(pubsub, "STREAM_HEARTBEAT_SECONDS", HEARTBEAT)
+    monkeypatch.setattr(pubsub, "status_hub", StatusHub())
+
+
+def test_busy_stream_ends_once_the_session_is_gone():
+    chunks, checks, hub = asyncio.run(busy_stream(authorized=False, seconds=2))
+    assert chunks[-1] == "event: expired\ndata: {}\n\n"
+    # Not a single idle heartbeat, yet the stream ends within about one interval
+    assert len(chunks) - 1 <= HEARTBEAT / EVENT_INTERVAL + 2
+    assert len(checks) == 1
+    assert hub.subscriber_count() == 0
+
+
+def test_busy_stream_is_rechecked_every_heartbeat():
+    chunks, checks, _ = asyncio.run(busy_stream(authorized=True, seconds=1))
+    assert all(chunk.startswith("data: ") for chunk in chunks)
+    assert 3 <= len(checks) <= 6
+
+
+def test_idle_stream_is_checked_on_the_heartbeat():
+
+    async def run():
+        async def still_authorized():
+            return False
+
+        stream = event_stream(pubsub.status_hub.subscribe(), lambda event: event, still_authorized=still_authorized)
+        return [chunk async for chunk in stream]
+
+    assert asyncio.run(run()) == ["event: expired\ndata: {}\n\n"]
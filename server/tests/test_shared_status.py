@@ -0,0 +1,170 @@
+import mmap
+import zlib
+
+import pytest
+
+from shared_status import SharedStatusTable, SEQ
+from status_cache import TableStatus
+
+SLOTS = 8
+
+
+def colliding_ids(count, slots=SLOTS):
+    """tableIds whose probe chains start at the same slot."""
+    ids = []
+    target = None
+    n = 0
+    while len(ids) < count:
+        table_id = f"T{n:05d}"
+        start = zlib.crc32(table_id.encode().ljust(16, b"\0")) % slots
+        if target is None:
+            target = start
+        if start == target:
+            ids.append(table_id)
+        n += 1
+    return ids
+
+
+@pytest.fixture
+def path(tmp_path):
+    return str(tmp_path / "status.bin")
+
+
+@pytest.fixture
+def table(path):
+    table = SharedStatusTable(path, SLOTS)
+    table.open()
+    yield table
+    table.close()
+
+
+def test_unopened_table_misses_and_refuses_writes(path):
+    table = SharedStatusTable(path, SLOTS)
+    assert table.get("T1") is None
+    assert table.set("T1", TableStatus("placed", 1)) is False
+    table.delete("T1")
+    table.close()
+
+
+def test_colliding_ids_probe_to_their_own_slots(table):
+    first, second, third = colliding_ids(3)
+    table.set(first, TableStatus("placed", 1))
+    table.set(second, TableStatus("processing", 2))
+    table.set(third, TableStatus("delivered", 3, isActive=False))
+
+    assert table.get(first) == TableStatus("placed", 1)
+    assert table.get(second) == TableStatus("processing", 2)
+    assert table.get(third) == TableStatus("delivered", 3, isActive=False)
+
+
+def test_delete_keeps_the_probe_chain_and_tombstone_is_reused(table):
+    first, second, third = colliding_ids(3)
+    table.set(first, TableStatus("placed", 1))
+    table.set(second, TableStatus("placed", 1))
+
+    table.delete(first)
+    assert table.get(first) is None
+    # second sits behind the tombstone and must still be found
+    assert table.get(second) == TableStatus("placed", 1)
+
+    table.set(third, TableStatus("idle", 5))
+    assert table.get(third) == TableStatus("idle", 5)
+    assert table.get(second) == TableStatus("placed", 1)
+
+
+def test_deleted_slots_are_reused(table):
+    # Far more ids than slots pass through; without reuse the table would fill up
+    for n in range(SLOTS * 4):
+        assert table.set(f"T{n}", TableStatus("placed", 1))
+        table.delete(f"T{n}")
+    assert table.set("LAST", TableStatus("placed", 1))
+
+
+def test_set_never_downgrades_across_instances(path, table):
+    other = SharedStatusTable(path, SLOTS)
+    other.open()
+    try:
+        table.set("T1", TableStatus("processing", 4))
+        assert other.get("T1") == TableStatus("processing", 4)
+
+        # A worker with an older view must not move the version back
+        other.set("T1", TableStatus("placed", 3))
+        assert table.get("T1") == TableStatus("processing", 4)
+
+        other.set("T1", TableStatus("delivered", 5))
+        assert table.get("T1") == TableStatus("delivered", 5)
+    finally:
+        other.close()
+
+
+def test_unknown_status_hides_the_older_entry(table):
+    table.set("T1", TableStatus("placed", 1))
+    assert table.set("T1", TableStatus("cleaning", 2)) is False
+    assert table.get("T1") is None
+
+
+def test_ids_that_do_not_fit_are_refused(table):
+    assert table.set("X" * 17, TableStatus("placed", 1)) is False
+    assert table.get("X" * 17) is None
+
+
+def test_full_table_refuses_new_ids(table):
+    ids = [f"T{n}" for n in range(SLOTS)]
+    for table_id in ids:
+        assert table.set(table_id, TableStatus("placed", 1))
+    assert table.set("EXTRA", TableStatus("placed", 1)) is False
+    assert all(table.get(table_id) == TableStatus("placed", 1) for table_id in ids)
+
+
+def test_a_worker_joining_a_running_server_keeps_the_entries(path, table):
+    table.set("T1", TableStatus("placed", 7))
+    joining = SharedStatusTable(path, SLOTS)
+    joining.open()
+    assert joining.get("T1") == TableStatus("placed", 7)
+    joining.close()
+    # Still running, so a replacement worker keeps them too
+    replacement = SharedStatusTable(path, SLOTS)
+    replacement.open()
+    assert replacement.get("T1") == TableStatus("placed", 7)
+    replacement.close()
+
+
+def test_a_new_server_start_clears_the_entries(path):
+    first_run = SharedStatusTable(path, SLOTS)
+    first_run.open()
+    # e.g. a table deleted from MongoDB while the server was down
+    first_run.set("T1", TableStatus("placed", 7))
+    first_run.close()
+
+    second_run = SharedStatusTable(path, SLOTS)
+    second_run.open()
+    assert second_run.get("T1") is None
+    second_run.close()
+
+
+def test_a_new_layout_clears_the_entries(path, table):
+    table.set("T1", TableStatus("placed", 7))
+    resized = SharedStatusTable(path, SLOTS * 2)
+    resized.open()
+    assert resized.get("T1") is None
+    resized.close()
+
+
+def test_entry_being_written_is_a_miss_until_the_write_completes(path, table):
+    table.set("T1", TableStatus("placed", 1))
+    key = b"T1".ljust(16, b"\0")
+
+    # Another process is halfway through publishing the slot: its sequence is odd
+    with open(path, "r+b") as shared_file, mmap.mmap(shared_file.fileno(), 0) as shared:
+        seq_at = shared.find(key) - SEQ.size
+        seq = SEQ.unpack_from(shared, seq_at)[0]
+        SEQ.pack_into(shared, seq_at, seq + 1)
+        assert table.get("T1") is None
+
+        SEQ.pack_into(shared, seq_at, seq + 2)
+        assert table.get("T1") == TableStatus("placed", 1)
+
+        # A writer that died mid-update leaves the slot odd; the next write repairs it
+        SEQ.pack_into(shared, seq_at, seq + 3)
+        assert table.set("T1", TableStatus("processing", 2))
+        assert table.get("T1") == TableStatus("processing", 2)
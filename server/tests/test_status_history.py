@@ -0,0 +1,119 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from status_history import StatusHistory, summarize_stats, DURATION_BUCKETS
+
+START = datetime(2026, 10, 18, 12, 0)
+
+
+@pytest.fixture
+def history(db):
+    return StatusHistory()
+
+
+def stats(db, key):
+    return summarize_stats(asyncio.run(db["status_stats"].find_one({"_id": key})))
+
+
+def transition(history, table_id, before, after, since, seconds):
+    history.record(
+        {"tableId": table_id, "status": before, "statusSince": since},
+        {"tableId": table_id, "status": after},
+        since + timedelta(seconds=seconds),
+    )
+
+
+def test_transitions_close_the_previous_status(db, history):
+    transition(history, "T1", "placed", "processing", START, 90)
+    transition(history, "T2", "placed", "processing", START, 30)
+    asyncio.run(history.flush())
+
+    overall = stats(db, "all:placed")
+    assert overall["count"] == 2
+    assert overall["averageSeconds"] == 60
+    assert stats(db, "table:T1:placed")["averageSeconds"] == 90
+    assert stats(db, "hour:12:placed")["count"] == 2
+
+
+def test_same_status_is_not_a_transition(db, history):
+    transition(history, "T1", "placed", "placed", START, 90)
+    asyncio.run(history.flush())
+    assert asyncio.run(db["status_stats"].find_one({"_id": "all:placed"})) is None
+
+
+def test_tables_without_status_since_are_skipped(db, history):
+    # Written before statusSince existed; its createdAt is weeks old
+    history.record(
+        {"tableId": "OLD", "status": "idle", "createdAt": START - timedelta(weeks=3)},
+        {"tableId": "OLD", "status": "placed"},
+        START,
+    )
+    asyncio.run(history.flush())
+    assert asyncio.run(db["status_stats"].find_one({"_id": "all:idle"})) is None
+    assert asyncio.run(db["status_events"].find_one({})) is None
+
+
+
+def test_percentiles_come_from_the_histogram(db, history):
+    # 90 quick services and 10 slow ones
+    for n in range(90):
+        transition(history, f"Q{n}", "processing", "delivered", START, 20)
+    for n in range(10):
+        transition(history, f"S{n}", "processing", "delivered", START, 1000)
+    asyncio.run(history.flush())
+
+    summary = stats(db, "all:processing")
+    assert summary["count"] == 100
+    assert summary["averageSeconds"] == 118
+    # Each percentile is the upper bound of the bucket it falls in
+    assert (summary["p50Seconds"], summary["p90Seconds"], summary["p95Seconds"]) == (30, 30, 1200)
+
+
+def test_percentiles_beyond_the_last_bucket_are_unknown(db, history):
+    transition(history, "T1", "placed", "processing", START, DURATION_BUCKETS[-1] + 1)
+    asyncio.run(history.flush())
+    summary = stats(db, "all:placed")
+    assert summary["averageSeconds"] == DURATION_BUCKETS[-1] + 1
+    assert summary["p50Seconds"] is None
+
+
+def test_empty_stats_summarize_to_nothing():
+    assert summarize_stats({"state": "idle"}) == {
+        "state": "idle", "count": 0, "averageSeconds": None,
+        "p50Seconds": None, "p90Seconds": None, "p95Seconds": None,
+    }
+
+
+def test_stats_add_up_across_flushes(db, history):
+    transition(history, "T1", "placed", "processing", START, 10)
+    asyncio.run(history.flush())
+    transition(history, "T1", "placed", "processing", START, 50)
+    asyncio.run(history.flush())
+    summary = stats(db, "table:T1:placed")
+    assert (summary["count"], summary["averageSeconds"], summary["p50Seconds"]) == (2, 30, 15)
+
+
+def test_failed_flush_is_written_by_the_next_one(db, history, monkeypatch):
+    collection = db["status_stats"]
+    write = collection.bulk_write
+    down = True
+
+    async def bulk_write(operations, **kwargs):
+        if down:
+            raise ConnectionError("MongoDB unavailable")
+        return await write(operations, **kwargs)
+
+    monkeypatch.setattr(collection, "bulk_write", bulk_write)
+    transition(history, "T1", "placed", "processing", START, 60)
+    with pytest.raises(ConnectionError):
+        asyncio.run(history.flush())
+
+    down = False
+    transition(history, "T1", "processing", "delivered", START, 120)
+    asyncio.run(history.flush())
+    assert stats(db, "all:placed")["count"] == 1
+    assert stats(db, "all:processing")["count"] == 1
+    # The events batch had already gone through and is not written twice
+    assert asyncio.run(db["status_events"].find_one({}))["count"] == 2
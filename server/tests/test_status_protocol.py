@@ -0,0 +1,226 @@
+import asyncio
+import socket
+import struct
+
+import pytest
+
+import metrics
+import status_protocol
+from status_cache import status_cache, TableStatus
+from status_protocol import (
+    MAC_SIZE, NO_VERSION, REPLY, RESULT_NOT_FOUND, RESULT_NOT_MODIFIED, RESULT_OK, RESULT_UNAUTHORIZED,
+    StatusProtocolServer, encode_reply, parse_query, sign,
+)
+
+KEY = b"s3cret"
+
+
+def query(table_id, version=None, request_id=7, key=None, raw_id=None):
+    table_bytes = raw_id if raw_id is not None else table_id.encode()
+    frame = struct.pack(
+        "!BBIIB", 1, 1 if key else 0, request_id, NO_VERSION if version is None else version, len(table_bytes)
+    ) + table_bytes
+    return frame + sign(key, frame) if key else frame
+
+
+def reply_fields(reply):
+    return REPLY.unpack(reply[:REPLY.size])
+
+
+@pytest.fixture
+def server():
+    status_cache.clear()
+    status_cache.set("T1", TableStatus("processing", 3))
+    status_cache.set("SIGNED", TableStatus("placed", 1, isActive=False))
+    server = StatusProtocolServer()
+    server.keys = {"SIGNED": KEY}
+    yield server
+    status_cache.clear()
+
+
+def test_parse_query_round_trip():
+    parsed = parse_query(query("T1", version=3, request_id=42))
+    assert (parsed.request_id, parsed.version, parsed.table_id, parsed.mac) == (42, 3, "T1", None)
+
+    parsed = parse_query(query("T1", key=KEY))
+    assert parsed.version is None
+    assert parsed.mac == sign(KEY, parsed.signed_part)
+    assert len(parsed.mac) == MAC_SIZE
+
+
+@pytest.mark.parametrize("frame", [
+    b"",
+    query("T1")[:5],
+    query("T1")[:-1],
+    query("T1") + b"x",
+    query("T1", key=KEY)[:-1],
+    b"\x02" + query("T1")[1:],  # unknown protocol version
+])
+def test_parse_query_rejects_bad_frames(frame):
+    with pytest.raises(ValueError):
+        parse_query(frame)
+
+
+def test_parse_query_rejects_non_utf8_ids():
+    with pytest.raises(ValueError):
+        parse_query(query(None, raw_id=b"\xff\xfe"))
+
+
+def test_encode_reply_fields():
+    reply = encode_reply(9, RESULT_OK, TableStatus("delivered", 2**32 + 5, isActive=False), next_poll_ms=2550)
+    assert len(reply) == REPLY.size
+    assert reply_fields(reply) == (1, RESULT_OK, 9, 3, 0, 5, 25)
+
+    assert reply_fields(encode_reply(9, RESULT_OK, TableStatus("cleaning", 1)))[3] == 0xFF
+    assert reply_fields(encode_reply(9, RESULT_OK, TableStatus("idle", 1), next_poll_ms=10**9))[6] == 0xFFFF
+    assert reply_fields(encode_reply(9, RESULT_NOT_FOUND)) == (1, RESULT_NOT_FOUND, 9, 0xFF, 0, 0, 0)
+
+
+def test_encode_reply_signs_with_the_key():
+    reply = encode_reply(9, RESULT_OK, TableStatus("idle", 1), key=KEY)
+    assert len(reply) == REPLY.size + MAC_SIZE
+    assert reply[REPLY.size:] == sign(KEY, reply[:REPLY.size])
+
+
+def test_answers_from_the_cache(server):
+    fields = reply_fields(server.answer_cached(parse_query(query("T1", request_id=5)), "10.0.0.2"))
+    assert fields[:6] == (1, RESULT_OK, 5, 2, 1, 3)
+    assert fields[6] > 0
+
+    fields = reply_fields(server.answer_cached(parse_query(query("T1", version=3)), "10.0.0.2"))
+    assert fields[1] == RESULT_NOT_MODIFIED
+
+
+def test_uncached_table_needs_a_lookup(server):
+    assert server.answer_cached(parse_query(query("NOPE")), None) is None
+
+
+def test_unknown_table_is_not_found(server, monkeypatch):
+    async def lookup(table_id):
+        return None
+
+    monkeypatch.setattr(status_protocol, "lookup_table_status", lookup)
+    reply = asyncio.run(server.answer(parse_query(query("NOPE")), None))
+    assert reply_fields(reply)[1] == RESULT_NOT_FOUND
+
+
+def test_signed_query_is_accepted_and_the_reply_signed(server):
+    reply = server.answer_cached(parse_query(query("SIGNED", key=KEY)), None)
+    assert reply_fields(reply)[1:5] == (RESULT_OK, 7, 1, 0)
+    assert reply[REPLY.size:] == sign(KEY, reply[:REPLY.size])
+
+
+@pytest.mark.parametrize("key", [None, b"wrong"])
+def test_table_with_a_key_refuses_unsigned_or_badly_signed_queries(server, key):
+    reply = server.answer_cached(parse_query(query("SIGNED", key=key)), None)
+    assert reply_fields(reply)[1] == RESULT_UNAUTHORIZED
+    # Nothing about the table leaks
+    assert reply_fields(reply)[3:] == (0xFF, 0, 0, 0)
+
+
+def test_require_hmac_refuses_tables_without_a_key(server, monkeypatch):
+    assert reply_fields(server.answer_cached(parse_query(query("T1")), None))[1] == RESULT_OK
+    monkeypatch.setattr(status_protocol, "STATUS_PROTOCOL_REQUIRE_HMAC", True)
+    assert reply_fields(server.answer_cached(parse_query(query("T1")), None))[1] == RESULT_UNAUTHORIZED
+    assert reply_fields(server.answer_cached(parse_query(query("SIGNED", key=KEY)), None))[1] == RESULT_OK
+
+
+
+class Lookups:
+    """Stands in for the MongoDB lookup of uncached tables; each one waits for release()."""
+
+    def __init__(self):
+        self.table_ids = []
+        self._released = None
+
+    async def __call__(self, table_id):
+        self.table_ids.append(table_id)
+        if self._released is None:
+            self._released = asyncio.Event()
+        await self._released.wait()
+        return None
+
+    def release(self):
+        if self._released is None:
+            self._released = asyncio.Event()
+        self._released.set()
+
+
+@pytest.fixture
+def lookups(server, monkeypatch):
+    lookups = Lookups()
+    monkeypatch.setattr(status_protocol, "lookup_table_status", lookups)
+    return lookups
+
+
+class ReplyCollector(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.results = {}
+
+    def datagram_received(self, data, addr):
+        fields = reply_fields(data)
+        self.results[fields[2]] = fields[1]
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as udp, socket.socket() as tcp:
+        udp.bind(("127.0.0.1", 0))
+        port = udp.getsockname()[1]
+        tcp.bind(("127.0.0.1", port))
+        return port
+
+
+def send_datagrams(frames, lookups):
+    """Send frames to a listening server, then let pending lookups finish; returns result by request id."""
+    async def run():
+        server = StatusProtocolServer("127.0.0.1", free_port())
+        await server.start()
+        collector = ReplyCollector()
+        client, _ = await asyncio.get_running_loop().create_datagram_endpoint(
+            lambda: collector, remote_addr=(server.host, server.port)
+        )
+        try:
+            for frame in frames:
+                client.sendto(frame)
+            await asyncio.sleep(0.2)
+            lookups.release()
+            await asyncio.sleep(0.2)
+        finally:
+            client.close()
+            await server.close()
+        return collector.results
+
+    return asyncio.run(run())
+
+
+def test_pending_lookups_are_capped(lookups, monkeypatch):
+    monkeypatch.setattr(status_protocol, "STATUS_PROTOCOL_MAX_PENDING", 4)
+    dropped = metrics.status_queries_dropped
+
+    results = send_datagrams([query(f"RND{n:03d}", request_id=n) for n in range(10)], lookups)
+    assert len(lookups.table_ids) == 4
+    assert metrics.status_queries_dropped - dropped == 6
+    assert list(results.values()) == [RESULT_NOT_FOUND] * 4
+
+
+def test_unknown_tables_are_not_looked_up_again_for_a_while(server, lookups):
+    lookups.release()
+    first = asyncio.run(server.answer(parse_query(query("NOPE", request_id=1)), None))
+    second = server.answer_cached(parse_query(query("NOPE", request_id=2)), None)
+    assert reply_fields(first)[1:3] == (RESULT_NOT_FOUND, 1)
+    assert reply_fields(second)[1:3] == (RESULT_NOT_FOUND, 2)
+    assert lookups.table_ids == ["NOPE"]
+
+
+def test_not_found_is_forgotten_after_a_while(server, lookups, monkeypatch):
+    monkeypatch.setattr(status_protocol, "STATUS_PROTOCOL_NOT_FOUND_SECONDS", 0)
+    lookups.release()
+    asyncio.run(server.answer(parse_query(query("NOPE")), None))
+    assert server.answer_cached(parse_query(query("NOPE")), None) is None
+
+
+def test_require_hmac_refuses_unknown_tables_before_any_lookup(lookups, monkeypatch):
+    monkeypatch.setattr(status_protocol, "STATUS_PROTOCOL_REQUIRE_HMAC", True)
+    results = send_datagrams([query(f"RND{n:03d}", request_id=n) for n in range(5)], lookups)
+    assert results == {n: RESULT_UNAUTHORIZED for n in range(5)}
+    assert lookups.table_ids == []
@@ -0,0 +1,180 @@
+import asyncio
+
+import pytest
+
+import database
+
+
+@pytest.fixture
+def duplicate_names(db):
+    # Written by a version that checked names with a racy find_one
+    asyncio.run(db["tables"].insert_many([
+        {"tableId": "AAA111", "tableName": "Patio", "status": "idle", "isActive": True, "version": 0},
+        {"tableId": "BBB222", "tableName": "Patio", "status": "idle", "isActive": True, "version": 0},
+        {"tableId": "CCC333", "tableName": "Bar", "status": "idle", "isActive": True, "version": 0},
+    ]))
+
+
+def test_starts_over_duplicate_names_and_checks_them_itself(duplicate_names, client, caplog):
+    assert client.get("/ready").status_code == 200
+    assert database.unchecked_unique_fields == {"tableName"}
+
+    response = client.post("/api/tables/", json={"tableName": "Bar"})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Table name already exists"
+    assert client.post("/api/tables/", json={"tableName": "Window"}).status_code == 200
+
+    bar = next(t for t in client.get("/api/tables/").json() if t["tableName"] == "Bar")
+    assert client.put(f"/api/tables/{bar['_id']}", json={"tableName": "Window"}).status_code == 400
+    # Keeping its own name is not a clash
+    assert client.put(f"/api/tables/{bar['_id']}", json={"tableName": "Bar"}).status_code == 200
+
+    result = client.post("/api/tables/bulk", json={"updates": [{"id": bar["_id"], "tableName": "Patio"}]}).json()
+    assert result["errors"] == [{"id": bar["_id"], "detail": "Table name already exists"}]
+
+
+def test_index_is_built_once_the_duplicates_are_gone(db, client):
+    assert database.unchecked_unique_fields == set()
+    client.post("/api/tables/", json={"tableName": "Bar"})
+    assert client.post("/api/tables/", json={"tableName": "Bar"}).status_code == 400
+
+
+def test_sync_cursor_trails_the_clock_and_deltas_repeat_only_that_window(client):
+    from datetime import datetime, timedelta
+    from settings import SYNC_CURSOR_LAG_SECONDS
+
+    client.post("/api/tables/", json={"tableName": "Patio"})
+    listing = client.get("/api/tables/")
+    cursor = datetime.fromisoformat(listing.headers["X-Sync-Cursor"])
+    lag = datetime.now() - cursor
+    assert timedelta(seconds=SYNC_CURSOR_LAG_SECONDS) <= lag < timedelta(seconds=SYNC_CURSOR_LAG_SECONDS + 1)
+
+    # Patio changed within the lag, so the next delta repeats it along with the new table
+    client.post("/api/tables/", json={"tableName": "Bar"})
+    delta = client.get("/api/tables/", params={"since": cursor.isoformat()}).json()
+    assert sorted(t["tableName"] for t in delta) == ["Bar", "Patio"]
+
+
+def create_tables(client, *names):
+    return [client.post("/api/tables/", json={"tableName": name}).json() for name in names]
+
+
+def test_bulk_updates_apply_per_table_and_report_per_item_errors(client):
+    patio, bar, window = create_tables(client, "Patio", "Bar", "Window")
+    missing = "0123456789abcdef01234567"
+    result = client.post("/api/tables/bulk", json={"updates": [
+        {"id": patio["_id"], "status": "placed"},
+        {"id": bar["_id"], "isActive": False},
+        {"id": window["_id"], "tableName": "Patio"},
+        {"id": "not-an-id", "status": "placed"},
+        {"id": bar["_id"]},
+        {"id": missing, "status": "placed"},
+    ]}).json()
+
+    updated = {t["tableName"]: t for t in result["tables"]}
+    assert set(updated) == {"Patio", "Bar"}
+    assert updated["Patio"]["status"] == "placed"
+    assert updated["Patio"]["version"] == patio["version"] + 1
+    assert updated["Patio"]["statusSince"] == updated["Patio"]["updatedAt"]
+    assert updated["Bar"]["isActive"] is False
+    assert updated["Bar"]["statusSince"] == bar["statusSince"]
+    assert sorted(result["errors"], key=lambda e: e["detail"]) == [
+        {"id": "not-an-id", "detail": "Invalid ID format"},
+        {"id": bar["_id"], "detail": "Nothing to update"},
+        {"id": window["_id"], "detail": "Table name already exists"},
+        {"id": missing, "detail": "Table not found"},
+    ]
+
+    tables = {t["tableName"]: t for t in client.get("/api/tables/").json()}
+    assert tables["Window"]["version"] == window["version"]
+
+
+def test_bulk_filter_applies_one_change_to_every_match(client):
+    patio, bar, window = create_tables(client, "Patio", "Bar", "Window")
+    client.post("/api/tables/bulk", json={"updates": [
+        {"id": patio["_id"], "status": "delivered"}, {"id": bar["_id"], "status": "delivered"},
+    ]})
+
+    result = client.post("/api/tables/bulk", json={
+        "filter": {"status": "delivered"}, "set": {"status": "idle"},
+    }).json()
+    assert sorted(t["tableName"] for t in result["tables"]) == ["Bar", "Patio"]
+    assert result["errors"] == []
+    assert {t["tableName"]: t["status"] for t in client.get("/api/tables/").json()} == {
+        "Patio": "idle", "Bar": "idle", "Window": "idle",
+    }
+
+    result = client.post("/api/tables/bulk", json={
+        "filter": {"ids": [window["_id"], "bad"]}, "set": {"isActive": False},
+    }).json()
+    assert [t["tableName"] for t in result["tables"]] == ["Window"]
+    assert result["errors"] == [{"id": "bad", "detail": "Invalid ID format"}]
+
+
+def test_bulk_status_changes_are_recorded_in_history(client):
+    from status_history import status_history
+
+    (patio,) = create_tables(client, "Patio")
+    client.post("/api/tables/bulk", json={"updates": [{"id": patio["_id"], "status": "placed"}]})
+    client.post("/api/tables/bulk", json={"filter": {"ids": [patio["_id"]]}, "set": {"status": "processing"}})
+    client.portal.call(status_history.flush)
+    states = {s["state"]: s["count"] for s in client.get("/api/tables/analytics").json()["states"]}
+    assert states == {"idle": 1, "placed": 1}
+
+
+@pytest.mark.parametrize("body, detail", [
+    ({"updates": [{"id": "0123456789abcdef01234567", "status": "idle"}], "filter": {"status": "idle"},
+      "set": {"status": "placed"}}, "Send either updates or filter, not both"),
+    ({"filter": {"status": "idle"}}, "filter requires set"),
+    ({"filter": {"status": "idle"}, "set": {}}, "Nothing to update"),
+    ({"filter": {"status": "idle"}, "set": {"tableName": "Same"}},
+     "tableName must be unique, rename tables through updates"),
+])
+def test_bulk_rejects_malformed_requests(client, body, detail):
+    response = client.post("/api/tables/bulk", json=body)
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail
+
+
+def test_since_returns_only_tables_changed_from_then(client):
+    from datetime import datetime
+
+    patio, bar = create_tables(client, "Patio", "Bar")
+    # As if the previous sync happened after both were created
+    since = datetime.now()
+    client.put(f"/api/tables/{bar['_id']}", json={"status": "placed"})
+
+    delta = client.get("/api/tables/", params={"since": since.isoformat()}).json()
+    assert [(t["tableName"], t["status"]) for t in delta] == [("Bar", "placed")]
+
+
+def test_keyset_pagination_walks_every_table_once(client):
+    names = [f"T{n:02d}" for n in range(7)]
+    create_tables(client, *names)
+    seen = []
+    after = None
+    while True:
+        params = {"limit": 3, **({"after": after} if after else {})}
+        page = client.get("/api/tables/", params=params).json()
+        if not page:
+            break
+        assert len(page) <= 3
+        seen += [t["tableName"] for t in page]
+        after = page[-1]["_id"]
+    assert seen == names
+
+
+def test_fields_projects_the_listing(client):
+    create_tables(client, "Patio")
+    (table,) = client.get("/api/tables/", params={"fields": "tableId,status"}).json()
+    assert set(table) == {"_id", "tableId", "status"}
+
+
+@pytest.mark.parametrize("params, detail", [
+    ({"fields": "status,secret"}, "Unknown fields: secret"),
+    ({"after": "not-an-id"}, "Invalid cursor"),
+])
+def test_listing_rejects_bad_parameters(client, params, detail):
+    response = client.get("/api/tables/", params=params)
+    assert response.status_code == 400
+    assert response.json()["detail"] == detail